@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+import sys,os,argparse,json,random,subprocess,time,shutil,collections,platform
+import boot_builder
+
+##########################################################################
+##########################################################################
+
+# Times boot_builder build-all on synthetic files lists, cold (empty
+# zx02 cache, no intermediate files) then warm (everything as left by
+# the cold run), recording wall clock time, peak RSS and per-stage
+# times (from --trace) to a JSON file that can be compared with
+# another revision's with --compare.
+#
+# By default compression is done by bin/zx02_standin.py, so this runs
+# without submodules/zx02 built. The stand-in is much slower than the
+# real thing, so cold times are only useful for comparing with other
+# runs that used it too.
+
+##########################################################################
+##########################################################################
+
+def fatal(msg):
+    sys.stderr.write('FATAL: %s\n'%msg)
+    sys.exit(1)
+
+def makedirs(path):
+    if not os.path.isdir(path): os.makedirs(path)
+
+def rmtree(path):
+    if os.path.isdir(path): shutil.rmtree(path)
+
+##########################################################################
+##########################################################################
+
+# Results file version. Bump when changing the format.
+VERSION=1
+
+MAX_SIZE=65536
+
+# Fraction of each file that's random bytes, the rest being copies of
+# earlier data.
+ENTROPIES=[0.0,0.05,0.25,0.5,0.75,0.99]
+
+# Make size bytes of data. Runs of random bytes (at most 200, so the
+# stand-in compressor can always encode it) alternate with copies of
+# earlier data.
+def make_data(rng,size,entropy):
+    data=bytearray()
+    while len(data)<size:
+        literal_length=rng.randint(1,max(1,int(entropy*200)))
+        data+=rng.randbytes(literal_length)
+        copy_length=round(literal_length*(1-entropy)/max(entropy,0.01))
+        copy_length=max(2,min(256,copy_length))
+        offset=rng.randint(1,min(len(data),32640))
+        # may overlap.
+        for i in range(copy_length): data.append(data[-offset])
+    return bytes(data[:size])
+
+# Sizes are log-uniform, so there's a good spread of small files.
+def make_size(rng): return int(2**rng.uniform(4,16))
+
+def get_compressed(file_index):
+    if file_index%8==6: return False
+    elif file_index%8==7: return 'auto'
+    else: return True
+
+# A list too big for one disk is split into several lists, one per
+# disk, as boot_builder doesn't yet support a list spanning disks. This
+# goes by the uncompressed sizes, leaving some room for data that gets
+# bigger when compressed.
+MAX_DISK_SIZE=boot_builder.MAX_FDLOAD_DATA_SIZE*7//8
+FilesList=collections.namedtuple('FilesList','py_paths num_files total_size')
+
+def make_files_list(folder_path,num_files,seed):
+    rng=random.Random('%s:%d'%(seed,num_files))
+    data_folder_path=os.path.join(folder_path,'data')
+    makedirs(data_folder_path)
+
+    total_size=0
+    disks_lines=[[]]
+    disk_size=0
+    for file_index in range(num_files):
+        data=make_data(rng,make_size(rng),rng.choice(ENTROPIES))
+        total_size+=len(data)
+        path=os.path.join(data_folder_path,'%d.dat'%file_index)
+        boot_builder.save_file(path,data)
+
+        file_size=boot_builder.get_num_sectors(len(data))*256
+        if (disk_size+file_size>MAX_DISK_SIZE or
+            len(disks_lines[-1])==boot_builder.MAX_NUM_FILES):
+            disks_lines.append([])
+            disk_size=0
+        disks_lines[-1].append('        boot_builder.File(path=%r,ident=%r,compressed=%r),'%
+                               (path,'f%d'%file_index,get_compressed(file_index)))
+        disk_size+=file_size
+
+    py_paths=[]
+    for disk_index,lines in enumerate(disks_lines):
+        py_path=os.path.join(folder_path,'files_list%d.py'%disk_index)
+        with open(py_path,'wt') as f:
+            f.write('import boot_builder\n')
+            f.write('def make_files_list():\n')
+            f.write('    return [\n')
+            for line in lines: f.write('%s\n'%line)
+            f.write('    ]\n')
+        py_paths.append(py_path)
+
+    return FilesList(py_paths=py_paths,num_files=num_files,total_size=total_size)
+
+##########################################################################
+##########################################################################
+
+def save_prg(path,addr,size):
+    boot_builder.save_file(path,bytes([addr&0xff,addr>>8])+bytes(size))
+
+# Returns path to pass as --zx02.
+def get_standin_zx02_path(work_folder_path):
+    standin_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'zx02_standin.py')
+    if os.name!='nt': return standin_path
+
+    # boot_builder runs --zx02 directly.
+    path=os.path.join(work_folder_path,'zx02_standin.bat')
+    with open(path,'wt') as f:
+        f.write('@"%s" "%s" %%*\n'%(sys.executable,standin_path))
+    return path
+
+# Returns (wall time,peak RSS in bytes). Peak RSS is None if
+# unavailable.
+def run(argv,log_path):
+    with open(log_path,'wt') as f:
+        start_time=time.perf_counter()
+        process=subprocess.Popen(argv,stdout=f,stderr=subprocess.STDOUT)
+        if hasattr(os,'wait4'):
+            pid,status,rusage=os.wait4(process.pid,0)
+            # (this is bytes on macOS, KB elsewhere.)
+            peak_rss=rusage.ru_maxrss
+            if sys.platform!='darwin': peak_rss*=1024
+            returncode=os.waitstatus_to_exitcode(status)
+        else:
+            returncode=process.wait()
+            peak_rss=None
+        wall_time=time.perf_counter()-start_time
+
+    if returncode!=0: fatal('boot_builder failed (see %s)'%log_path)
+    return wall_time,peak_rss
+
+# Seconds spent in each stage, from the --trace output. Compression
+# done by workers is summed as 'compress (workers)'.
+def get_stage_times(trace_path):
+    with open(trace_path,'rt') as f: events=json.load(f)['traceEvents']
+    main_tid=None
+    for event in events:
+        if event['ph']=='M' and event['args']['name']=='main':
+            main_tid=event['tid']
+
+    times=collections.defaultdict(float)
+    for event in events:
+        if event['ph']!='X': continue
+        name=event['name']
+        if event['tid']!=main_tid: name+=' (workers)'
+        times[name]+=event['dur']/1e6
+    return dict(sorted(times.items()))
+
+def benchmark(files_list,folder_path,mode,options):
+    intermediate_folder_path=os.path.join(folder_path,'intermediate')
+    zx02_cache_path=os.path.join(folder_path,'zx02_cache')
+    output_folder_path=os.path.join(folder_path,'output')
+    if mode=='cold':
+        rmtree(intermediate_folder_path)
+        rmtree(zx02_cache_path)
+        rmtree(output_folder_path)
+    makedirs(intermediate_folder_path)
+    makedirs(output_folder_path)
+
+    trace_path=os.path.join(folder_path,'trace_%s.json'%mode)
+    argv=[sys.executable,
+          os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'boot_builder.py')]
+    for disk_index,py_path in enumerate(files_list.py_paths):
+        argv+=['--list',py_path,
+               '--intermediate-folder',os.path.join(intermediate_folder_path,
+                                                    str(disk_index))]
+    argv+=['--zx02',options.zx02_path,
+           '--zx02-cache',zx02_cache_path,
+           '--trace',trace_path]
+    if options.zx02_quick: argv.append('--zx02-quick')
+    if options.zx02_jobs is not None:
+        argv+=['--zx02-jobs',str(options.zx02_jobs)]
+    argv+=['build-all',
+           '--loader0',os.path.join(options.work_folder_path,'loader0.prg')]
+    for disk_index in range(len(files_list.py_paths)):
+        argv+=['--loader1',os.path.join(options.work_folder_path,'loader1.prg'),
+               '--output-asm',os.path.join(output_folder_path,
+                                           'files%d.s65'%disk_index),
+               '--output-adl',os.path.join(output_folder_path,
+                                           'disk%d.adl'%disk_index)]
+
+    wall_time,peak_rss=run(argv,os.path.join(folder_path,'%s.log'%mode))
+    return {
+        'num_files':files_list.num_files,
+        'total_size':files_list.total_size,
+        'mode':mode,
+        'wall_time':wall_time,
+        'peak_rss':peak_rss,
+        'stages':get_stage_times(trace_path),
+    }
+
+##########################################################################
+##########################################################################
+
+def get_git_revision():
+    folder_path=os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision=subprocess.run(['git','rev-parse','--short','HEAD'],
+                                cwd=folder_path,
+                                check=True,
+                                capture_output=True,
+                                text=True).stdout.strip()
+        status=subprocess.run(['git','status','--porcelain','--untracked-files=no'],
+                              cwd=folder_path,
+                              check=True,
+                              capture_output=True,
+                              text=True).stdout.strip()
+        if status!='': revision+='-dirty'
+        return revision
+    except (OSError,subprocess.CalledProcessError): return None
+
+def get_rss_str(peak_rss):
+    if peak_rss is None: return '-'
+    return '{:,.1f} MB'.format(peak_rss/(1024*1024))
+
+def get_change_str(old,new):
+    if old is None or new is None or old==0: return '-'
+    return '{:+.1%}'.format(new/old-1)
+
+def print_results(results,old_results):
+    old_run_by_key={}
+    if old_results is not None:
+        for run in old_results['runs']:
+            old_run_by_key[(run['num_files'],run['mode'])]=run
+
+    for run in results['runs']:
+        old_run=old_run_by_key.get((run['num_files'],run['mode']))
+        print('{:,} files ({:,} bytes), {}: {:.2f} s; peak RSS {}'.format(
+            run['num_files'],
+            run['total_size'],
+            run['mode'],
+            run['wall_time'],
+            get_rss_str(run['peak_rss'])))
+        if old_run is not None:
+            print('  vs {}: {:.2f} s ({}); peak RSS {} ({})'.format(
+                old_results['revision'],
+                old_run['wall_time'],
+                get_change_str(old_run['wall_time'],run['wall_time']),
+                get_rss_str(old_run['peak_rss']),
+                get_change_str(old_run['peak_rss'],run['peak_rss'])))
+
+        for name,seconds in run['stages'].items():
+            line='  {:<30}{:>10.3f} s'.format(name,seconds)
+            if old_run is not None:
+                line+='  {:>10}'.format(get_change_str(old_run['stages'].get(name),
+                                                       seconds))
+            print(line)
+
+##########################################################################
+##########################################################################
+
+def main(argv):
+    parser=argparse.ArgumentParser(description='''benchmark boot_builder on synthetic files lists''')
+    parser.add_argument('-o','--output',metavar='FILE',dest='output_path',default=None,help='''write results to %(metavar)s. Default: results.json in the work folder''')
+    parser.add_argument('--compare',metavar='FILE',dest='compare_path',default=None,help='''compare with results in %(metavar)s''')
+    parser.add_argument('--num-files',metavar='N,...',default='1,50,200,1000',help='''benchmark lists of each of %(metavar)s files. Default: %(default)s''')
+    parser.add_argument('--seed',default='0',help='''seed for the random data. Default: %(default)s''')
+    parser.add_argument('--zx02',metavar='PATH',dest='zx02_path',default=None,help='''use zx02 binary %(metavar)s. Default: bin/zx02_standin.py''')
+    parser.add_argument('--zx02-quick',action='store_true',help='''use zx02 quick non-optimal compression''')
+    parser.add_argument('--zx02-jobs',metavar='N',type=int,default=None,help='''pass --zx02-jobs %(metavar)s to boot_builder''')
+    parser.add_argument('work_folder_path',metavar='FOLDER',help='''put files lists, data, intermediate files and output in %(metavar)s''')
+    options=parser.parse_args(argv)
+
+    try: num_files_values=[int(x) for x in options.num_files.split(',')]
+    except ValueError: fatal('invalid --num-files: %s'%options.num_files)
+    if any([x<1 for x in num_files_values]):
+        fatal('invalid --num-files: %s'%options.num_files)
+
+    old_results=None
+    if options.compare_path is not None:
+        with open(options.compare_path,'rt') as f: old_results=json.load(f)
+        if old_results.get('version')!=VERSION:
+            fatal('can\'t compare with results version %s: %s'%
+                  (old_results.get('version'),options.compare_path))
+
+    options.work_folder_path=os.path.abspath(options.work_folder_path)
+    makedirs(options.work_folder_path)
+    if options.output_path is None:
+        options.output_path=os.path.join(options.work_folder_path,
+                                         'results.json')
+    if options.zx02_path is None:
+        options.zx02_path=get_standin_zx02_path(options.work_folder_path)
+
+    save_prg(os.path.join(options.work_folder_path,'loader0.prg'),0x2000,512)
+    save_prg(os.path.join(options.work_folder_path,'loader1.prg'),0x2000,2048)
+
+    results={
+        'version':VERSION,
+        'revision':get_git_revision(),
+        'python':platform.python_version(),
+        'platform':platform.platform(),
+        'zx02':options.zx02_path,
+        'zx02_quick':options.zx02_quick,
+        'seed':options.seed,
+        'runs':[],
+    }
+    for num_files in num_files_values:
+        folder_path=os.path.join(options.work_folder_path,str(num_files))
+        files_list=make_files_list(folder_path,num_files,options.seed)
+        for mode in ['cold','warm']:
+            sys.stderr.write('%d files, %s...\n'%(num_files,mode))
+            results['runs'].append(benchmark(files_list,
+                                             folder_path,
+                                             mode,
+                                             options))
+
+    with open(options.output_path,'wt') as f:
+        json.dump(results,f,indent=4*' ')
+
+    print_results(results,old_results)
+
+if __name__=='__main__': main(sys.argv[1:])
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+import sys,os,argparse,time,subprocess,hashlib,importlib.util
+
+##########################################################################
+##########################################################################
+
+# Times png.Reader decoding as a build step sees it: each decode runs
+# in a fresh process, and the time includes importing png, and NumPy
+# if it gets used. The default configuration (NumPy only if the image
+# is big enough to pay for importing it - see png.numpy_min_bytes) is
+# compared with never and always using NumPy, and all must give the
+# same results.
+
+MODES=['default','python','numpy']
+
+def get_default_paths():
+    root_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+    return [os.path.normpath(os.path.join(root_path,'data/GhoulsRevenge.png')),
+            os.path.normpath(os.path.join(root_path,'tests/geebeeyay_8x16.png'))]
+
+# Run in the child process. Prints the time taken, whether NumPy was
+# used, and the decoded rows' hash.
+def decode(mode,path):
+    start_time=time.perf_counter()
+    # (the import is part of what's being timed.)
+    import png
+    if mode=='python': png.use_numpy=False
+    elif mode=='numpy': png.numpy_min_bytes=0
+    width,height,rows,info=png.Reader(filename=path).asRGBA()
+    rows=[bytes(row) for row in rows]
+    t=time.perf_counter()-start_time
+
+    h=hashlib.sha256()
+    for row in rows: h.update(row)
+    print(t,png.numpy is not None,h.hexdigest())
+
+# Returns (best time,whether NumPy was used,hash of decoded rows).
+def time_decode(mode,path,num_repeats):
+    best_time=None
+    for i in range(num_repeats):
+        argv=[sys.executable,os.path.abspath(__file__),'--decode',mode,path]
+        output=subprocess.run(argv,check=True,stdout=subprocess.PIPE,text=True).stdout.split()
+        t=float(output[0])
+        if best_time is None or t<best_time: best_time=t
+    return best_time,output[1]=='True',output[2]
+
+def main(argv):
+    parser=argparse.ArgumentParser(description='''benchmark png.Reader, in its default configuration and with and without NumPy''')
+    parser.add_argument('-n',metavar='N',dest='num_repeats',type=int,default=10,help='''decode each file %(metavar)s times, taking the best. Default: %(default)s''')
+    parser.add_argument('--decode',metavar='MODE',choices=MODES,help='''(internal) decode FILE once in mode %(metavar)s and print the results''')
+    parser.add_argument('paths',metavar='FILE',nargs='*',help='''decode %(metavar)s. Default: data/GhoulsRevenge.png and tests/geebeeyay_8x16.png''')
+    options=parser.parse_args(argv)
+
+    if options.decode is not None:
+        for path in options.paths: decode(options.decode,path)
+        return
+
+    modes=MODES
+    if importlib.util.find_spec('numpy') is None:
+        sys.stderr.write('WARNING: NumPy not available, so only timing decoding without it\n')
+        modes=['default','python']
+
+    paths=options.paths or get_default_paths()
+    for path in paths:
+        results={mode:time_decode(mode,path,options.num_repeats) for mode in modes}
+        if len(set(result[2] for result in results.values()))!=1:
+            sys.stderr.write('FATAL: %s: decoded data differs between modes\n'%path)
+            sys.exit(1)
+        line='{}: default: {:.2f} ms ({})'.format(
+            path,
+            results['default'][0]*1e3,
+            'NumPy' if results['default'][1] else 'no NumPy')
+        line+='; no NumPy: {:.2f} ms'.format(results['python'][0]*1e3)
+        if 'numpy' in results:
+            line+='; NumPy: {:.2f} ms'.format(results['numpy'][0]*1e3)
+        print(line)
+
+if __name__=='__main__': main(sys.argv[1:])
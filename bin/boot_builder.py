@@ -1,5 +1,7 @@
 #!/usr/bin/python3
-import sys,os,argparse,collections,json,dataclasses,importlib,importlib.util,struct,hashlib,subprocess
+import sys,os,argparse,collections,json,dataclasses,importlib,importlib.util,struct,hashlib,subprocess,time
+import concurrent.futures,mmap,contextlib,functools
+import zx02_stream,fdload_timing,frame_delta
 
 ##########################################################################
 ##########################################################################
@@ -11,6 +13,66 @@ def fatal(msg):
 ##########################################################################
 ##########################################################################
 
+# Wall clock time spans, saved in Chrome trace event format, for
+# loading into chrome://tracing or https://ui.perfetto.dev/.
+#
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+#
+# Times are from time.time(), so that spans from worker processes line
+# up with the main process's. Each worker process gets its own row.
+class Trace:
+    def __init__(self):
+        self._pid=os.getpid()
+        self._events=[]
+        self._tids=set()
+        self._add_thread_name(self._pid,'main')
+
+    def _add_thread_name(self,tid,name):
+        self._tids.add(tid)
+        self._events.append({'name':'thread_name',
+                             'ph':'M',
+                             'pid':self._pid,
+                             'tid':tid,
+                             'args':{'name':name}})
+
+    def add_span(self,name,start_time,end_time,tid=None,**args):
+        if tid is None: tid=self._pid
+        elif tid not in self._tids: self._add_thread_name(tid,'worker %d'%tid)
+        self._events.append({'name':name,
+                             'ph':'X',
+                             'pid':self._pid,
+                             'tid':tid,
+                             'ts':start_time*1e6,
+                             'dur':(end_time-start_time)*1e6,
+                             'args':args})
+
+    @contextlib.contextmanager
+    def span(self,name,**args):
+        start_time=time.time()
+        try: yield
+        finally: self.add_span(name,start_time,time.time(),**args)
+
+    def save(self,path):
+        with open(path,'wt') as f:
+            json.dump({'traceEvents':self._events,'displayTimeUnit':'ms'},f)
+
+# The Trace, if --trace was specified.
+g_trace=None
+
+def trace_span(name,**args):
+    if g_trace is None: return contextlib.nullcontext()
+    return g_trace.span(name,**args)
+
+# Decorator: record a span, named after the function, for each call.
+def traced(fun):
+    @functools.wraps(fun)
+    def traced_fun(*args,**kwargs):
+        with trace_span(fun.__name__): return fun(*args,**kwargs)
+    return traced_fun
+
+##########################################################################
+##########################################################################
+
 def makedirs(path):
     if not os.path.isdir(path): os.makedirs(path)
 
@@ -18,7 +80,211 @@ def load_file(path):
     with open(path,'rb') as f: return f.read()
 
 def save_file(path,data):
-    with open(path,'wb') as f: f.write(data)
+    with trace_span('write',path=path):
+        with open(path,'wb') as f: f.write(data)
+
+##########################################################################
+##########################################################################
+
+# Persistent record of file hashes, keyed by path and indexed by
+# (size, mtime_ns, inode), so that files that haven't changed since
+# last time don't need reading and hashing again.
+class HashIndex:
+    VERSION=1
+    
+    def __init__(self,path):
+        self._path=path
+        self._dirty=False
+        self._files={}
+        try:
+            with open(self._path,'rt') as f: j=json.load(f)
+            if j.get('version')==HashIndex.VERSION:
+                self._files=j['files']
+        except FileNotFoundError: pass
+        except (ValueError,KeyError) as e:
+            # just start again.
+            sys.stderr.write('WARNING: ignoring bad hash index: %s: %s\n'%
+                             (self._path,e))
+
+    def get_stat_key(self,st): return [st.st_size,st.st_mtime_ns,st.st_ino]
+
+    # Returns None if no entry, or the entry is stale.
+    def get_hash(self,key,stat_key):
+        entry=self._files.get(key)
+        if entry is None or entry['stat']!=stat_key: return None
+        return entry['hash']
+
+    def set_hash(self,key,stat_key,hash):
+        entry={'stat':stat_key,'hash':hash}
+        if self._files.get(key)!=entry:
+            self._files[key]=entry
+            self._dirty=True
+
+    def save(self):
+        if not self._dirty: return
+        makedirs(os.path.dirname(self._path))
+        temp_path='%s.%d.tmp'%(self._path,os.getpid())
+        with open(temp_path,'wt') as f:
+            json.dump({'version':HashIndex.VERSION,
+                       'files':self._files},
+                      f,
+                      indent=1,
+                      sort_keys=True)
+        os.replace(temp_path,self._path)
+        self._dirty=False
+
+##########################################################################
+##########################################################################
+
+# File contents, hashes and compressed data for the current run,
+# shared by every File object. A file that's on more than one disk
+# (or in more than one list) is only read and hashed once, and if it
+# hasn't changed since it was last hashed, it isn't read or hashed at
+# all (unless verify is set).
+class FileStore:
+    def __init__(self,hash_index,verify=False):
+        self._hash_index=hash_index
+        self._verify=verify
+        self._data_by_path={}
+        self._hash_by_path={}
+        self._zx02_data_by_hash={}
+        self._zx02_compress_time_by_hash={}
+
+    @property
+    def hash_index(self): return self._hash_index
+
+    def _get_key(self,path): return os.path.normpath(path)
+
+    # Returns None if the file doesn't exist.
+    def get_data(self,path):
+        key=self._get_key(path)
+        data=self._data_by_path.get(key)
+        if data is None:
+            try: data=load_file(path)
+            except FileNotFoundError: return None
+            self._data_by_path[key]=data
+        return data
+
+    def get_hash(self,path):
+        key=self._get_key(path)
+        hash=self._hash_by_path.get(key)
+        if hash is None:
+            # stat before reading: if the file changes in between, the
+            # index entry will be out of date, so it'll get rehashed
+            # next time.
+            stat_key=self._hash_index.get_stat_key(os.stat(path))
+            index_hash=self._hash_index.get_hash(key,stat_key)
+            if index_hash is not None and not self._verify: hash=index_hash
+            else:
+                with trace_span('hash',path=path):
+                    data=self.get_data(path)
+                    assert data is not None
+                    hash=hashlib.sha256(data).hexdigest()
+                if index_hash is not None and index_hash!=hash:
+                    sys.stderr.write('WARNING: file changed without its metadata changing: %s\n'%path)
+                self._hash_index.set_hash(key,stat_key,hash)
+            self._hash_by_path[key]=hash
+        return hash
+
+    # Returns None if not known.
+    def get_size(self,path):
+        data=self._data_by_path.get(self._get_key(path))
+        if data is not None: return len(data)
+        try: return os.path.getsize(path)
+        except FileNotFoundError: return None
+
+    def get_zx02_data(self,u_hash): return self._zx02_data_by_hash.get(u_hash)
+
+    def set_zx02_data(self,u_hash,c_data):
+        self._zx02_data_by_hash[u_hash]=c_data
+
+    # Time spent compressing this run, for the build report. None if
+    # the data came from the cache.
+    def get_zx02_compress_time(self,u_hash):
+        return self._zx02_compress_time_by_hash.get(u_hash)
+
+    def set_zx02_compress_time(self,u_hash,compress_time):
+        self._zx02_compress_time_by_hash[u_hash]=compress_time
+
+##########################################################################
+##########################################################################
+
+# Per-entry info for the zx02 cache, stored in the cache folder and
+# keyed by hash:
+#
+# last_access - time of last use, for LRU eviction
+#
+# quick - True if compressed with zx02 -q, False if not. Missing if not
+# known (entries created by older versions of boot_builder)
+#
+# prefix_hash, prefix_path - for an entry compressed against a prefix,
+# the prefix data's hash and the (absolute) path it came from, so
+# upgrade_zx02_cache_cmd can find it again
+#
+# Several builds might share the cache, so saving merges with whatever
+# is on disk rather than just overwriting it.
+class ZX02CacheIndex:
+    VERSION=1
+
+    def __init__(self,cache_path):
+        self._path=os.path.join(cache_path,'index.json')
+        self._entries=self._load()
+        self._changes={}
+        self._removed=set()
+
+    def _load(self):
+        try:
+            with open(self._path,'rt') as f: j=json.load(f)
+            if j.get('version')==ZX02CacheIndex.VERSION: return j['entries']
+        except FileNotFoundError: pass
+        except (ValueError,KeyError) as e:
+            sys.stderr.write('WARNING: ignoring bad zx02 cache index: %s: %s\n'%
+                             (self._path,e))
+        return {}
+
+    # Returns None if no entry.
+    def get_entry(self,u_hash): return self._entries.get(u_hash)
+
+    def set_values(self,u_hash,**values):
+        entry=dict(self._entries.get(u_hash,{}))
+        entry.update(values)
+        if 'last_access' not in entry: entry['last_access']=time.time()
+        self._entries[u_hash]=entry
+        self._changes[u_hash]=entry
+        self._removed.discard(u_hash)
+
+    def touch(self,u_hash,**values):
+        self.set_values(u_hash,last_access=time.time(),**values)
+
+    def remove(self,u_hash):
+        self._entries.pop(u_hash,None)
+        self._changes.pop(u_hash,None)
+        self._removed.add(u_hash)
+
+    def save(self):
+        if len(self._changes)==0 and len(self._removed)==0: return
+
+        entries=self._load()
+        for u_hash,entry in self._changes.items():
+            old_entry=entries.get(u_hash)
+            if (old_entry is not None and
+                old_entry.get('last_access',0)>entry['last_access']):
+                entry=dict(entry,last_access=old_entry['last_access'])
+            entries[u_hash]=entry
+        for u_hash in self._removed: entries.pop(u_hash,None)
+
+        makedirs(os.path.dirname(self._path))
+        temp_path='%s.%d.tmp'%(self._path,os.getpid())
+        with open(temp_path,'wt') as f:
+            json.dump({'version':ZX02CacheIndex.VERSION,'entries':entries},
+                      f,
+                      indent=1,
+                      sort_keys=True)
+        os.replace(temp_path,self._path)
+
+        self._entries=entries
+        self._changes={}
+        self._removed=set()
 
 ##########################################################################
 ##########################################################################
@@ -28,20 +294,75 @@ def save_file(path,data):
 # ident = suffix for the identifier used to refer to this file in
 # the 6502 code.
 
+# prefix_path = path of file compressed against (zx02 -p), or None.
+# prefix_hash is its hash, and u_hash is then a hash of both hashes
+# rather than the hash of the uncompressed data.
 ZX02CacheEntry=collections.namedtuple('ZX02CacheEntry',
-                                      'u_data u_hash u_path c_folder c_path')
+                                      'u_size u_hash u_path c_folder c_path prefix_path prefix_hash')
+
+def get_zx02_args(quick,u_path,c_path,prefix_size=0):
+    args=[]
+    if quick: args.append('-q')
+    if prefix_size>0: args+=['-p',str(prefix_size)]
+    args.append(u_path)
+    args.append(c_path)
+    return args
+
+##########################################################################
+##########################################################################
+
+# Runs the zx02 binary, once per file.
+class ZX02Compressor:
+    def __init__(self,zx02_path):
+        self._zx02_path=zx02_path
+
+    # Compress u_path to c_path, treating the first prefix_size bytes
+    # as data to compress against rather than data to compress. If
+    # log_path is not None, zx02's stdout output goes there.
+    def compress(self,u_path,c_path,quick,log_path=None,prefix_size=0):
+        argv=[self._zx02_path]+get_zx02_args(quick,u_path,c_path,prefix_size)
+        if log_path is None: subprocess.run(argv,check=True)
+        else:
+            with open(log_path,'wt') as f:
+                subprocess.run(argv,check=True,stdout=f)
+
+##########################################################################
+##########################################################################
 
-def get_zx02_q_arg(options):
-    if options.zx02_quick: return '-q'
-    else: return ''
+# compressed may be True, False, or 'auto' - compress the file if the
+# models predict that loading and decompressing the zx02 data will be
+# quicker than loading the raw data.
+#
+# group may be the name of a group of related files. Each file in a
+# group (after the first) is compressed against the previous file in
+# the group, so its data must be decompressed to immediately after
+# the previous file's data in memory. Its TOC entry says so, and fdload
+# does this itself, ignoring the load address. The files must be
+# compressed=True, so fdload knows where each one ends.
+#
+# dictionary may be the path of a file to compress against, so the
+# dictionary data must be in memory immediately before the file's
+# data when decompressing. The first file in a group is compressed
+# against the group's dictionary, if any.
 
 # TODO: could/should this be a dataclass?
 class File:
-    def __init__(self,path,ident,compressed=False,execute=False):
+    def __init__(self,path,ident,compressed=False,execute=False,group=None,dictionary=None):
+        if compressed not in [False,True,'auto']:
+            fatal('compressed must be True, False or \'auto\': %s'%path)
+        if (group is not None or dictionary is not None) and not compressed:
+            fatal('group/dictionary only makes sense for compressed files: %s'%path)
+        if group is not None and compressed is not True:
+            fatal('group needs compressed=True: %s'%path)
         self._path=path
         self._ident=ident
-        self._compressed=compressed
+        self._compression=compressed
+        self._compressed=None if compressed=='auto' else compressed
         self._execute=execute
+        self._group=group
+        self._dictionary=dictionary
+        self._prefix_path=dictionary
+        self._continues=False
         self._options=None
         self._disk_data=None    # may be compressed
         self._memory_data=None
@@ -53,89 +374,654 @@ class File:
     def ident(self): return self._ident
 
     @property
-    def compressed(self): return self._compressed
+    def compressed(self):
+        if self._compressed is None:
+            self._compressed=self._get_auto_compressed()
+        return self._compressed
+
+    # True if the file might end up compressed, so zx02 data will be
+    # needed.
+    @property
+    def may_compress(self): return self._compression in [True,'auto']
 
     @property
     def execute(self): return self._execute
 
+    @property
+    def group(self): return self._group
+
+    @property
+    def dictionary(self): return self._dictionary
+
+    # Path of file the zx02 data is compressed against, or None.
+    @property
+    def prefix_path(self): return self._prefix_path
+
+    # True if compressed against the previous file in its group, so
+    # fdload decompresses it to immediately after that one.
+    @property
+    def continues(self): return self._continues
+
+    def set_prev_group_file_path(self,path):
+        if self._execute:
+            fatal('execute isn\'t supported for a file compressed against the previous file in its group, as it doesn\'t go at its load address: %s'%self._path)
+        self._prefix_path=path
+        self._continues=True
+
     def set_options(self,options):
         assert self._options is None
         self._options=options
 
+    # Called once any parts have been built, before the file's data is
+    # needed. For files whose data is generated by boot_builder.
+    def update(self): pass
+
+    # Extra constants for the asm constants file: list of (suffix,value)
+    # pairs, giving file_IDENT_suffix=value.
+    def get_asm_constants(self): return []
+
     def get_memory_data(self):
         if self._memory_data is None:
-            try: self._memory_data=load_file(self._path)
-            except FileNotFoundError:
+            self._memory_data=self._options.g_file_store.get_data(self._path)
+            if self._memory_data is None:
                 fatal('not found (because not built?): %s'%self._path)
         assert self._memory_data is not None
         return self._memory_data
 
-    def _get_zx02_cache_entry(self):
-        assert self.compressed
-        u_data=self.get_memory_data()
-        u_hash=hashlib.sha256(u_data).hexdigest()
+    # If prefixed is False, the entry is for the file compressed on
+    # its own, ignoring any group or dictionary.
+    def _get_zx02_cache_entry(self,prefixed=True):
+        assert self.may_compress
+        if not os.path.isfile(self._path):
+            fatal('not found (because not built?): %s'%self._path)
+        store=self._options.g_file_store
+        u_hash=store.get_hash(self._path)
+        u_size=store.get_size(self._path)
+
+        prefix_path=None
+        prefix_hash=None
+        if prefixed and self._prefix_path is not None:
+            prefix_path=self._prefix_path
+            if not os.path.isfile(prefix_path):
+                fatal('not found (because not built?): %s'%prefix_path)
+            prefix_hash=store.get_hash(prefix_path)
+            u_hash=hashlib.sha256(('%s:%s'%(prefix_hash,u_hash)).encode('ascii')).hexdigest()
+
         c_folder=os.path.join(self._options.g_zx02_cache_path,u_hash[:3])
         c_path=os.path.join(c_folder,'%s.zx02'%u_hash)
-        return ZX02CacheEntry(u_data=u_data,
+        return ZX02CacheEntry(u_size=u_size,
                               u_hash=u_hash,
                               u_path=self.path,
                               c_folder=c_folder,
-                              c_path=c_path)
+                              c_path=c_path,
+                              prefix_path=prefix_path,
+                              prefix_hash=prefix_hash)
+
+    def _get_zx02_prefix_size(self):
+        if self._prefix_path is None: return 0
+        return self._options.g_file_store.get_size(self._prefix_path)
+
+    def _get_zx02_data(self,prefixed=True):
+        ent=self._get_zx02_cache_entry(prefixed)
+        store=self._options.g_file_store
+        index=self._options.g_zx02_cache_index
+        c_data=store.get_zx02_data(ent.u_hash)
+        if c_data is None:
+            if not os.path.isfile(ent.c_path):
+                start_time=time.perf_counter()
+                with trace_span('compress',path=ent.u_path):
+                    compress_zx02_cache_entry(self._options.g_zx02_compressor,
+                                              ent,
+                                              self._options.zx02_quick)
+                store.set_zx02_compress_time(ent.u_hash,
+                                             time.perf_counter()-start_time)
+                index.set_values(ent.u_hash,
+                                 **get_zx02_cache_index_values(
+                                     ent,
+                                     self._options.zx02_quick))
+            with trace_span('zx02 cache read',path=ent.u_path):
+                c_data=load_file(ent.c_path)
+            store.set_zx02_data(ent.u_hash,c_data)
+        index.touch(ent.u_hash)
+        return c_data
+
+    # Time spent compressing the file this run, or None if its zx02
+    # data came from the cache.
+    def get_zx02_compress_time(self):
+        u_hash=self._get_zx02_cache_entry().u_hash
+        return self._options.g_file_store.get_zx02_compress_time(u_hash)
+
+    # Size of the file's zx02 data when compressed on its own, for
+    # comparison, or None if there's none in the zx02 cache. (Files
+    # aren't compressed a second time just for this.)
+    def get_standalone_zx02_size(self):
+        ent=self._get_zx02_cache_entry(prefixed=False)
+        if not os.path.isfile(ent.c_path): return None
+        return os.path.getsize(ent.c_path)
+
+    # True if the file's zx02 data was compressed in quick mode, False
+    # if not, or None if not known.
+    def get_zx02_quick(self,prefixed=True):
+        ent=self._get_zx02_cache_entry(prefixed)
+        entry=self._options.g_zx02_cache_index.get_entry(ent.u_hash)
+        if entry is None: return None
+        return entry.get('quick')
 
     def get_disk_data(self):
         if self._disk_data is None:
-            if self.compressed:
-                ent=self._get_zx02_cache_entry()
-                if not os.path.isfile(ent.c_path):
-                    makedirs(ent.c_folder)
-                    argv=[self._options.g_zx02_path,
-                          get_zx02_q_arg(self._options),
-                          ent.u_path,
-                          ent.c_path]
-                    subprocess.run(argv,check=True)
-                self._disk_data=load_file(ent.c_path)
+            if self.compressed: self._disk_data=self._get_zx02_data()
             else: self._disk_data=self.get_memory_data()
         assert self._disk_data is not None
         return self._disk_data
+
+    # Decide whether to compress, based on predicted time to load
+    # (and, if compressed, decompress) the file on its own.
+    def _get_auto_compressed(self):
+        u_size=len(self.get_memory_data())
+        c_data=self._get_zx02_data()
+        raw_time=fdload_timing.get_standalone_load_time(u_size)
+
+        reads=fdload_timing.get_track_reads(2,0,len(c_data))
+        try:
+            chunk_cycles=zx02_stream.get_chunk_decompression_cycles(
+                c_data,
+                [read.num_bytes for read in reads],
+                prefix_size=self._get_zx02_prefix_size())
+        except zx02_stream.FormatError as e:
+            sys.stderr.write('WARNING: %s: can\'t predict decompression time, so compressing: %s\n'%(self.path,e))
+            return True
+
+        model=fdload_timing.DEFAULT_DRIVE_MODEL
+        chunk_times=[cycles/model.cpu_hz for cycles in chunk_cycles]
+        def get_process_time(read): return chunk_times.pop(0)
+        zx02_time=fdload_timing.get_standalone_load_time(len(c_data),
+                                                         get_process_time)
+
+        compressed=zx02_time<raw_time
+        print('{}: auto compression: raw={:,} bytes, {:.1f} ms; zx02={:,} bytes, {:.1f} ms: {}'.format(
+            self.path,
+            u_size,raw_time*1000,
+            len(c_data),zx02_time*1000,
+            'zx02' if compressed else 'raw'))
+        return compressed
+
+    # Per-chunk zx02 stream info (see zx02_stream.get_chunk_info),
+    # when the file is read in chunks of the given sizes. None if the
+    # zx02 data couldn't be understood. Cached in the zx02 cache index.
+    def get_zx02_chunk_info(self,chunk_sizes):
+        assert self.may_compress
+        ent=self._get_zx02_cache_entry()
+        c_data=self._get_zx02_data()
+        index=self._options.g_zx02_cache_index
+
+        # the key includes the size, so an upgraded entry gets redone.
+        key=[zx02_stream.CYCLES_MODEL_VERSION,len(c_data),list(chunk_sizes)]
+        entry=index.get_entry(ent.u_hash)
+        if entry is not None and entry.get('chunks_key')==key:
+            if entry['chunks'] is None: return None
+            return [zx02_stream.ChunkInfo(*chunk) for chunk in entry['chunks']]
+
+        try:
+            chunks=zx02_stream.get_chunk_info(
+                c_data,
+                chunk_sizes,
+                prefix_size=self._get_zx02_prefix_size())
+        except zx02_stream.FormatError as e:
+            sys.stderr.write('WARNING: %s: can\'t predict decompression time: %s\n'%(self.path,e))
+            chunks=None
+
+        index.set_values(ent.u_hash,
+                         chunks=None if chunks is None else [list(chunk) for chunk in chunks],
+                         chunks_key=key)
+        return chunks
+
+# Sequence of same-sized frames, stored as frame 0 plus a delta for
+# each subsequent frame (see frame_delta.py). The encoded data is
+# written to the intermediate folder and treated like any other file
+# from then on, so it can be compressed too.
+class FrameSequenceFile(File):
+    def __init__(self,frame_paths,ident,compressed=False,execute=False,group=None,dictionary=None):
+        super().__init__(None,
+                         ident,
+                         compressed=compressed,
+                         execute=execute,
+                         group=group,
+                         dictionary=dictionary)
+        self._frame_paths=list(frame_paths)
+        if len(self._frame_paths)>frame_delta.MAX_NUM_FRAMES:
+            fatal('too many frames: %d (max %d): %s'%(len(self._frame_paths),
+                                                     frame_delta.MAX_NUM_FRAMES,
+                                                     ident))
+
+    def set_options(self,options):
+        super().set_options(options)
+        self._path=os.path.join(options.g_intermediate_folder_path,
+                                'frames',
+                                '%s.dat'%self.ident)
+
+    def update(self):
+        frames=[]
+        for frame_path in self._frame_paths:
+            frame=self._options.g_file_store.get_data(frame_path)
+            if frame is None:
+                fatal('not found (because not built?): %s'%frame_path)
+            frames.append(frame)
+
+        try: data=frame_delta.encode(frames)
+        except frame_delta.FormatError as e: fatal('%s: %s'%(self.ident,e))
+
+        # don't touch the file if it's unchanged, so its hash doesn't
+        # need recalculating.
+        if not os.path.isfile(self._path) or load_file(self._path)!=data:
+            makedirs(os.path.dirname(self._path))
+            save_file(self._path,data)
+
+        cycles=frame_delta.get_frames_cycles(data)
+        print('{}: {:,} frames: {:,} -> {:,} bytes; max {:,} cycles/frame'.format(
+            self.ident,
+            len(frames),
+            sum([len(frame) for frame in frames]),
+            len(data),
+            max(cycles) if len(cycles)>0 else 0))
+
+    def get_asm_constants(self):
+        return [('num_frames',len(self._frame_paths))]
+
+def update_files(files):
+    for file in files: file.update()
     
-def warm_zx02_cache_cmd(files,options):
+# Compress to a temp file and rename it into place, so that a failed
+# or interrupted compression doesn't leave a bogus cache entry.
+def compress_zx02_cache_entry(compressor,ent,quick,log_path=None):
+    makedirs(ent.c_folder)
+    temp_c_path='%s.%d.tmp'%(ent.c_path,os.getpid())
+    if ent.prefix_path is None:
+        compressor.compress(ent.u_path,temp_c_path,quick,log_path=log_path)
+    else:
+        # zx02 wants the prefix and the data in the same file.
+        prefix=load_file(ent.prefix_path)
+        temp_u_path='%s.%d.u.tmp'%(ent.c_path,os.getpid())
+        save_file(temp_u_path,prefix+load_file(ent.u_path))
+        try:
+            compressor.compress(temp_u_path,
+                                temp_c_path,
+                                quick,
+                                log_path=log_path,
+                                prefix_size=len(prefix))
+        finally: os.unlink(temp_u_path)
+    os.replace(temp_c_path,ent.c_path)
+
+# Values to record in the cache index for a new entry.
+def get_zx02_cache_index_values(ent,quick):
+    values={'quick':quick}
+    if ent.prefix_hash is not None:
+        values['prefix_hash']=ent.prefix_hash
+        values['prefix_path']=os.path.abspath(ent.prefix_path)
+    return values
+
+# Per-process compressor for the warmup worker processes.
+g_worker_zx02_compressor=None
+
+def init_zx02_worker(zx02_path):
+    global g_worker_zx02_compressor,g_trace
+    # (the trace is the main process's business.)
+    g_trace=None
+    g_worker_zx02_compressor=ZX02Compressor(zx02_path)
+
+ZX02JobResult=collections.namedtuple('ZX02JobResult','start_time end_time pid')
+
+def zx02_worker_job(ent,quick):
+    start_time=time.time()
+    compress_zx02_cache_entry(g_worker_zx02_compressor,
+                              ent,
+                              quick,
+                              log_path='%s.txt'%ent.c_path)
+    return ZX02JobResult(start_time=start_time,
+                         end_time=time.time(),
+                         pid=os.getpid())
+
+# Compress everything that needs compressing, in parallel. The
+# compressed data ends up in the cache as normal, and also in the file
+# store, so the later stages can use it without reloading it.
+@traced
+def warm_zx02_cache(files,options):
     ent_by_hash={}
     for file in files:
-        if file.compressed and os.path.isfile(file.path):
+        if file.may_compress and os.path.isfile(file.path):
             ent=file._get_zx02_cache_entry()
             if not os.path.isfile(ent.c_path): ent_by_hash[ent.u_hash]=ent
 
     if len(ent_by_hash)==0: return # no warming required.
-    
-    makefile_path=os.path.join(options.g_intermediate_folder_path,
-                               'zx02_cache_warmup_makefile.mak')
-    def target(ent): return 'f_%s'%ent.u_hash
-
-    all_targets=' '.join([target(ent) for ent in ent_by_hash.values()])
-    with open(makefile_path,'wt') as f:
-        f.write('.PHONY:all %s\n'%all_targets)
-        f.write('all: %s\n'%all_targets)
-        number=1
-        for hash,ent in ent_by_hash.items():
-            f.write('%s:\n'%target(ent))
-            f.write('\t@echo Compressing file: %d/%d\n'%(number,len(ent_by_hash)))
-
-            # qnd $ quoting for GNU Make purposes.
-            quoted_u_path=ent.u_path.replace('$','$$')
-            f.write('\t@"%s" %s "%s" "%s" > "%s"\n'%
-                    (options.g_zx02_path,
-                     get_zx02_q_arg(options),
-                     quoted_u_path,
-                     ent.c_path,
-                     '%s.txt'%ent.c_path))
-
-            makedirs(ent.c_folder)
-            number+=1
-
-    argv=[options.make_path,
-          '-j',str(os.cpu_count()),
-          '-f',makefile_path]
-    subprocess.run(argv,check=True)
+
+    # Do the largest files first, as they'll take the longest, and
+    # the small ones can fill in the gaps at the end.
+    ents=sorted(ent_by_hash.values(),key=lambda ent:ent.u_size,reverse=True)
+
+    num_jobs=options.g_zx02_jobs
+    if num_jobs is None: num_jobs=os.cpu_count()
+    num_jobs=max(1,min(num_jobs,len(ents)))
+
+    start_time=time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_jobs,
+            initializer=init_zx02_worker,
+            initargs=(options.g_zx02_path,)) as executor:
+        ent_by_future={}
+        for ent in ents:
+            future=executor.submit(zx02_worker_job,ent,options.zx02_quick)
+            ent_by_future[future]=ent
+
+        num_done=0
+        pending=set(ent_by_future.keys())
+        while len(pending)>0:
+            done,pending=concurrent.futures.wait(
+                pending,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                ent=ent_by_future[future]
+                try: result=future.result()
+                except Exception as e:
+                    # stop as soon as possible: don't start anything
+                    # else.
+                    for future in pending: future.cancel()
+                    executor.shutdown(wait=True,cancel_futures=True)
+                    fatal('failed to compress: %s: %s'%(ent.u_path,e))
+
+                job_time=result.end_time-result.start_time
+                if g_trace is not None:
+                    g_trace.add_span('compress',
+                                     result.start_time,
+                                     result.end_time,
+                                     tid=result.pid,
+                                     path=ent.u_path)
+
+                num_done+=1
+                c_data=load_file(ent.c_path)
+                options.g_file_store.set_zx02_data(ent.u_hash,c_data)
+                options.g_file_store.set_zx02_compress_time(ent.u_hash,job_time)
+                options.g_zx02_cache_index.touch(
+                    ent.u_hash,
+                    **get_zx02_cache_index_values(ent,options.zx02_quick))
+                print('Compressed file: %d/%d: %s: %d -> %d (%.2f s)'%(
+                    num_done,len(ents),ent.u_path,ent.u_size,len(c_data),job_time))
+
+    print('Compressed %d file(s) in %.2f s (%d job(s))'%(
+        len(ents),time.perf_counter()-start_time,num_jobs))
+
+def warm_zx02_cache_cmd(files,options):
+    update_files(files)
+    warm_zx02_cache(files,options)
+
+##########################################################################
+##########################################################################
+
+# zx02 cache garbage collection.
+#
+# Entries for files in the lists are the root set, and are never
+# evicted. Other entries are evicted if they're older than max_age
+# seconds (going by last access, or the file's mtime if there's no
+# index entry), then least recently used first until the total size is
+# no more than max_bytes.
+
+ZX02CacheBlob=collections.namedtuple('ZX02CacheBlob',
+                                     'u_hash paths num_bytes last_access')
+
+def parse_size(s):
+    scales={'K':1024,'M':1024*1024,'G':1024*1024*1024}
+    scale=scales.get(s[-1:].upper())
+    try:
+        if scale is None: return int(s)
+        else: return int(float(s[:-1])*scale)
+    except ValueError: raise argparse.ArgumentTypeError('bad size: %s'%s)
+
+def get_zx02_root_hashes(files):
+    root_hashes=set()
+    for file in files:
+        if file.may_compress and os.path.isfile(file.path):
+            root_hashes.add(file._get_zx02_cache_entry().u_hash)
+            root_hashes.add(file._get_zx02_cache_entry(False).u_hash)
+    return root_hashes
+
+def scan_zx02_cache(cache_path,index):
+    paths_by_hash=collections.defaultdict(list)
+    junk_paths=[]
+    if os.path.isdir(cache_path):
+        for folder_name in os.listdir(cache_path):
+            folder_path=os.path.join(cache_path,folder_name)
+            if len(folder_name)!=3 or not os.path.isdir(folder_path): continue
+            for name in os.listdir(folder_path):
+                path=os.path.join(folder_path,name)
+                if name.endswith('.zx02'): paths_by_hash[name[:-5]].insert(0,path)
+                elif name.endswith('.zx02.txt'): paths_by_hash[name[:-9]].append(path)
+                elif name.endswith('.tmp'):
+                    # leftovers from an interrupted compression. Leave
+                    # anything recent, as it might be in progress.
+                    if time.time()-os.path.getmtime(path)>24*60*60:
+                        junk_paths.append(path)
+
+    blobs=[]
+    for u_hash,paths in paths_by_hash.items():
+        if not paths[0].endswith('.zx02'):
+            # log with no compressed data.
+            junk_paths+=paths
+            continue
+        entry=index.get_entry(u_hash)
+        if entry is not None: last_access=entry['last_access']
+        else: last_access=os.path.getmtime(paths[0])
+        blobs.append(ZX02CacheBlob(u_hash=u_hash,
+                                   paths=paths,
+                                   num_bytes=sum([os.path.getsize(path) for path in paths]),
+                                   last_access=last_access))
+
+    return blobs,junk_paths
+
+@traced
+def gc_zx02_cache(root_hashes,options,max_bytes,max_age,dry_run=False):
+    index=options.g_zx02_cache_index
+    blobs,junk_paths=scan_zx02_cache(options.g_zx02_cache_path,index)
+
+    total_bytes=sum([blob.num_bytes for blob in blobs])
+    evicted=[]
+    kept=[]
+    now=time.time()
+    for blob in sorted(blobs,key=lambda blob:blob.last_access):
+        if blob.u_hash in root_hashes: kept.append(blob)
+        elif max_age is not None and now-blob.last_access>max_age:
+            evicted.append(blob)
+        else: kept.append(blob)
+
+    # kept is in LRU order.
+    if max_bytes is not None:
+        num_bytes=sum([blob.num_bytes for blob in kept])
+        i=0
+        while num_bytes>max_bytes and i<len(kept):
+            if kept[i].u_hash in root_hashes: i+=1
+            else:
+                num_bytes-=kept[i].num_bytes
+                evicted.append(kept[i])
+                del kept[i]
+
+    evicted_bytes=sum([blob.num_bytes for blob in evicted])
+    print('zx02 cache: %s%d/%d entries (%s/%s bytes) evicted; %d live'%(
+        'would be ' if dry_run else '',
+        len(evicted),len(blobs),
+        '{:,}'.format(evicted_bytes),'{:,}'.format(total_bytes),
+        len(root_hashes)))
+
+    if dry_run: return
+
+    for path in junk_paths: os.unlink(path)
+    for blob in evicted:
+        for path in blob.paths: os.unlink(path)
+        index.remove(blob.u_hash)
+
+    if os.path.isdir(options.g_zx02_cache_path):
+        for folder_name in os.listdir(options.g_zx02_cache_path):
+            folder_path=os.path.join(options.g_zx02_cache_path,folder_name)
+            if (len(folder_name)==3 and os.path.isdir(folder_path) and
+                len(os.listdir(folder_path))==0):
+                os.rmdir(folder_path)
+
+    index.save()
+
+def get_max_age_seconds(days):
+    if days is None: return None
+    return days*24*60*60
+
+##########################################################################
+##########################################################################
+
+# Recompress quick mode cache entries at full quality, in low priority
+# worker processes, so the cache gradually fills up with optimal
+# entries without needing a full rebuild.
+#
+# The cache only stores the compressed data, so the uncompressed data
+# comes from decompressing it. The results are checked, and the new
+# entry is only swapped in if it's smaller.
+#
+# An entry compressed against a prefix needs the prefix data to
+# decompress and recompress it, which comes from the prefix_path
+# recorded in the index - if that file still has the same hash.
+
+def init_zx02_upgrade_worker(zx02_path):
+    if hasattr(os,'nice'):
+        try: os.nice(19)
+        except OSError: pass
+    init_zx02_worker(zx02_path)
+
+ZX02UpgradeResult=collections.namedtuple('ZX02UpgradeResult',
+                                         'old_size new_size time')
+
+def zx02_upgrade_job(u_hash,c_path,prefix_hash=None,prefix_path=None):
+    start_time=time.perf_counter()
+    prefix=b''
+    if prefix_hash is not None:
+        prefix=load_file(prefix_path)
+        if hashlib.sha256(prefix).hexdigest()!=prefix_hash:
+            raise RuntimeError('prefix file has changed: %s'%prefix_path)
+
+    old_c_data=load_file(c_path)
+    u_data=zx02_stream.decompress(old_c_data,prefix)
+    data_hash=hashlib.sha256(u_data).hexdigest()
+    if prefix_hash is not None:
+        data_hash=hashlib.sha256(('%s:%s'%(prefix_hash,data_hash)).encode('ascii')).hexdigest()
+    if data_hash!=u_hash:
+        raise RuntimeError('decompressed data has wrong hash')
+
+    temp_u_path='%s.%d.u.tmp'%(c_path,os.getpid())
+    temp_c_path='%s.%d.tmp'%(c_path,os.getpid())
+    # zx02 wants the prefix and the data in the same file.
+    save_file(temp_u_path,prefix+u_data)
+    try:
+        g_worker_zx02_compressor.compress(temp_u_path,
+                                          temp_c_path,
+                                          False,
+                                          log_path='%s.txt'%temp_c_path,
+                                          prefix_size=len(prefix))
+        new_c_data=load_file(temp_c_path)
+        if zx02_stream.decompress(new_c_data,prefix)!=u_data:
+            raise RuntimeError('recompressed data decompresses wrongly')
+        if len(new_c_data)<len(old_c_data):
+            os.replace('%s.txt'%temp_c_path,'%s.txt'%c_path)
+            os.replace(temp_c_path,c_path)
+    finally:
+        for path in [temp_u_path,temp_c_path,'%s.txt'%temp_c_path]:
+            if os.path.isfile(path): os.unlink(path)
+
+    return ZX02UpgradeResult(old_size=len(old_c_data),
+                             new_size=min(len(old_c_data),len(new_c_data)),
+                             time=time.perf_counter()-start_time)
+
+def upgrade_zx02_cache_cmd(options):
+    index=options.g_zx02_cache_index
+    blobs,junk_paths=scan_zx02_cache(options.g_zx02_cache_path,index)
+
+    candidates=[]
+    for blob in blobs:
+        entry=index.get_entry(blob.u_hash)
+        # entries compressed against a prefix can't be checked or
+        # recompressed without the prefix. Older versions of
+        # boot_builder didn't record where it came from.
+        if (entry is not None and 'prefix_hash' in entry and
+            'prefix_path' not in entry):
+            continue
+        quick=None if entry is None else entry.get('quick')
+        if quick or (quick is None and options.include_unknown):
+            candidates.append(blob)
+
+    # Most recently used first: they're the ones most likely to be on
+    # a disk.
+    candidates.sort(key=lambda blob:blob.last_access,reverse=True)
+    if options.limit is not None: candidates=candidates[:options.limit]
+    if len(candidates)==0:
+        print('zx02 cache: no entries to upgrade')
+        return
+
+    num_jobs=options.g_zx02_jobs
+    if num_jobs is None: num_jobs=os.cpu_count()
+    num_jobs=max(1,min(num_jobs,len(candidates)))
+
+    old_total=0
+    new_total=0
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_jobs,
+            initializer=init_zx02_upgrade_worker,
+            initargs=(options.g_zx02_path,)) as executor:
+        blob_by_future={}
+        for blob in candidates:
+            entry=index.get_entry(blob.u_hash) or {}
+            future=executor.submit(zx02_upgrade_job,
+                                   blob.u_hash,
+                                   blob.paths[0],
+                                   entry.get('prefix_hash'),
+                                   entry.get('prefix_path'))
+            blob_by_future[future]=blob
+
+        for num_done,future in enumerate(concurrent.futures.as_completed(blob_by_future)):
+            blob=blob_by_future[future]
+            try: result=future.result()
+            except Exception as e:
+                # leave the entry be. It's still usable.
+                sys.stderr.write('WARNING: failed to upgrade: %s: %s\n'%(blob.paths[0],e))
+                continue
+
+            # it's only worth doing once, whether it got any smaller or
+            # not.
+            index.set_values(blob.u_hash,quick=False)
+
+            old_total+=result.old_size
+            new_total+=result.new_size
+            print('Upgraded entry: %d/%d: %s: %d -> %d (%.2f s)'%(
+                num_done+1,len(candidates),blob.u_hash,
+                result.old_size,result.new_size,result.time))
+
+            # save as it goes, in case it's interrupted.
+            index.save()
+
+    print('zx02 cache: upgrade: {:,} -> {:,} bytes'.format(old_total,new_total))
+
+def gc_zx02_cache_cmd(options):
+    if len(options.g_intermediate_folder_paths)!=len(options.g_list_py_paths):
+        fatal('must supply --intermediate-folder once per --list (got %d, expected %d)'%
+              (len(options.g_intermediate_folder_paths),
+               len(options.g_list_py_paths)))
+
+    all_files=[]
+    for list_py_path,intermediate_folder_path in zip(options.g_list_py_paths,
+                                                     options.g_intermediate_folder_paths):
+        list_options=argparse.Namespace(**vars(options))
+        list_options.g_list_py_path=list_py_path
+        list_options.g_intermediate_folder_path=intermediate_folder_path
+        all_files+=load_files_list(list_py_path,list_options)
+
+    if options.max_bytes is None and options.max_age is None:
+        fatal('must specify --max-bytes and/or --max-age')
+
+    gc_zx02_cache(get_zx02_root_hashes(all_files),
+                  options,
+                  options.max_bytes,
+                  get_max_age_seconds(options.max_age),
+                  dry_run=options.dry_run)
     
 ##########################################################################
 ##########################################################################
@@ -222,11 +1108,13 @@ def get_exec_part(options):
 
 # def get_filler(n): return n*b'\x00'
 
-def check_budget(data,max_size,description):
-    
-    if len(data)>max_size:
+def check_size_budget(size,max_size,description):
+    if size>max_size:
         fatal('too large: %d bytes (max is %d; overrun by %d): %s'%
-              (len(data),max_size,len(data)-max_size,description))
+              (size,max_size,size-max_size,description))
+
+def check_budget(data,max_size,description):
+    check_size_budget(len(data),max_size,description)
 
 # def check_budget_and_pad(data,max_size,description):
 #     assert isinstance(data,bytearray),type(data)
@@ -247,7 +1135,9 @@ def check_budget(data,max_size,description):
 #     sector:int
 #     num_bytes:int
 
-TOCEntry=collections.namedtuple('TOCEntry','file index ltrack sector num_bytes')
+# offset is the offset of the file's data in its start sector. Always
+# 0 unless the layout is packed.
+TOCEntry=collections.namedtuple('TOCEntry','file index ltrack sector offset num_bytes')
 
 ##########################################################################
 ##########################################################################
@@ -258,35 +1148,188 @@ def get_fdload_data_path(options):
 
 MAX_FDLOAD_DATA_SIZE=2*79*16*256
 
-def build_fdload_data_cmd(files,options):
-    fdload_data=bytearray()
-    
-    toc=[]
-    file_contents=[]
-
-    # assert len(fdload_data)==4096
-    for file_index,file in enumerate(files):
+FDLoadData=collections.namedtuple('FDLoadData','data toc')
+
+def get_num_sectors(num_bytes): return (num_bytes+255)//256
+
+# The TOC's file count is a byte.
+MAX_NUM_FILES=255
+
+# Name of the disk, for messages.
+def get_disk_name(options):
+    name=os.path.splitext(os.path.basename(options.g_list_py_path))[0]
+    if options.g_span_disk_index is not None:
+        name+=' (disk %d)'%options.g_span_disk_index
+    return name
+
+# File indexes in the order the files list says they're loaded. If
+# the list doesn't say, assume list order.
+def get_load_order(files,options):
+    if options.load_order is None: return list(range(len(files)))
+
+    index_by_ident={}
+    for file_index,file in enumerate(files): index_by_ident[file.ident]=file_index
+
+    load_order=[]
+    for ident in options.load_order:
+        if ident not in index_by_ident:
+            fatal('unknown ident in load order: %s'%ident)
+        load_order.append(index_by_ident[ident])
+    return load_order
+
+def get_modelled_load_time(lsectors,sizes,load_order):
+    placements=[fdload_timing.get_placement(lsector,size)
+                for lsector,size in zip(lsectors,sizes)]
+    return fdload_timing.simulate_loads(placements,load_order).time
+
+# Print how much space each compression group (or, for files not in
+# a group, each dictionary) saves, compared to compressing each file
+# on its own. The standalone zx02 data comes from the cache, if it's
+# there, e.g. from before the file was grouped; a file without any is
+# left out. So is a file whose grouped and standalone zx02 data are of
+# different quality (e.g., only one has been through
+# upgrade-zx02-cache), as it would skew the comparison.
+def print_compression_groups_report(files,options):
+    files_by_name={}
+    for file in files:
+        if file.group is not None: name='group %s'%file.group
+        elif file.dictionary is not None: name='dictionary %s'%file.dictionary
+        else: continue
+        files_by_name.setdefault(name,[]).append(file)
+
+    for name,group_files in files_by_name.items():
+        num_bytes=0
+        standalone_num_bytes=0
+        num_sectors=0
+        standalone_num_sectors=0
+        num_skipped=0
+        for file in group_files:
+            size=len(file.get_disk_data())
+            if file.compressed:
+                standalone_size=file.get_standalone_zx02_size()
+                if (standalone_size is None or
+                    file.get_zx02_quick()!=file.get_zx02_quick(prefixed=False)):
+                    num_skipped+=1
+                    continue
+            else: standalone_size=size
+            num_bytes+=size
+            standalone_num_bytes+=standalone_size
+            num_sectors+=get_num_sectors(size)
+            standalone_num_sectors+=get_num_sectors(standalone_size)
+
+        line='{}: {}: {:,} file(s): {:,} bytes; compressed individually: {:,} bytes; saved {:,} bytes ({:,} sectors)'.format(
+            get_disk_name(options),
+            name,
+            len(group_files)-num_skipped,
+            num_bytes,
+            standalone_num_bytes,
+            standalone_num_bytes-num_bytes,
+            standalone_num_sectors-num_sectors)
+        if num_skipped>0:
+            line+=' ({:,} file(s) not compared, as not in zx02 cache on their own, or compressed at different quality)'.format(num_skipped)
+        print(line)
+
+def get_laid_out_lsectors(files,sizes,options):
+    lsectors=fdload_timing.get_sequential_lsectors(sizes,32)
+    if options.optimise_layout:
+        load_order=get_load_order(files,options)
+        list_order_time=get_modelled_load_time(lsectors,sizes,load_order)
+        lsectors=fdload_timing.optimise_layout(sizes,
+                                               load_order,
+                                               MAX_FDLOAD_DATA_SIZE//256,
+                                               32)
+        optimised_time=get_modelled_load_time(lsectors,sizes,load_order)
+        print('{}: modelled load time: list order={:.2f} s; optimised={:.2f} s ({:+.1%})'.format(
+            get_disk_name(options),
+            list_order_time,
+            optimised_time,
+            optimised_time/list_order_time-1))
+    return lsectors
+
+# Packed layout: a compressed file starts immediately after the
+# previous file, sharing its last sector, rather than at the start of
+# a sector. fdload reads whole sectors, and it's only for compressed
+# files that it can skip the part before the file (it reads them into
+# a buffer, and starts decompressing from the offset), so other files
+# still start at the start of a sector. The files stay in list order.
+# Returns position of each file in the fdload data.
+def get_packed_positions(files,sizes):
+    positions=[]
+    position=0
+    for file,size in zip(files,sizes):
+        # TOC size includes the offset, and 65536 would be 0.
+        if not file.compressed or position%256+size>65535:
+            position=get_num_sectors(position)*256
+        positions.append(position)
+        position+=size
+    return positions
+
+@traced
+def make_fdload_data(files,options):
+    if len(files)>MAX_NUM_FILES:
+        fatal('too many files: %d (max %d)'%(len(files),MAX_NUM_FILES))
+
+    # Lay out the files first, so the data can go straight into a
+    # buffer of the right size.
+    sizes=[]
+    for file in files:
         file_data=file.get_disk_data()
 
         if len(file_data)==0: fatal('unsupported 0 byte file: %s'%file.path)
 
         check_budget(file_data,65536,file.path)
 
-        assert len(fdload_data)%256==0
-        lsector=32+len(fdload_data)//256
-        
+        sizes.append(len(file_data))
+
+    print_compression_groups_report(files,options)
+
+    if options.pack:
+        if options.optimise_layout:
+            fatal('can\'t optimise layout of packed fdload data')
+        positions=get_packed_positions(files,sizes)
+    else:
+        check_size_budget(sum([get_num_sectors(size)*256 for size in sizes]),
+                          MAX_FDLOAD_DATA_SIZE,
+                          'fdload data')
+        lsectors=get_laid_out_lsectors(files,sizes,options)
+        positions=[(lsector-32)*256 for lsector in lsectors]
+
+    toc=[]
+    data_size=0
+    for file_index,file in enumerate(files):
+        lsector=32+positions[file_index]//256
         toc.append(TOCEntry(file=file,
                             index=file_index,
                             ltrack=lsector//16,
                             sector=lsector%16,
-                            num_bytes=len(file_data)))
-        #file_contents.append(file_data)
-
-        fdload_data+=file_data
-        n=len(fdload_data)%256
-        if n!=0: fdload_data+=bytearray(256-n)
-
-    check_budget(fdload_data,MAX_FDLOAD_DATA_SIZE,'fdload data')
+                            offset=positions[file_index]%256,
+                            num_bytes=sizes[file_index]))
+        data_size=max(data_size,
+                      get_num_sectors(positions[file_index]+sizes[file_index])*256)
+
+    check_size_budget(data_size,MAX_FDLOAD_DATA_SIZE,'fdload data')
+
+    if options.pack:
+        unpacked_size=sum([get_num_sectors(size)*256 for size in sizes])
+        print('{}: packed: {:,} bytes; unpacked: {:,} bytes; reclaimed {:,} bytes ({:,} sectors)'.format(
+            get_disk_name(options),
+            data_size,
+            unpacked_size,
+            unpacked_size-data_size,
+            (unpacked_size-data_size)//256))
+
+    # Padding is already zero.
+    fdload_data=bytearray(data_size)
+    with memoryview(fdload_data) as fdload_view:
+        for entry,position in zip(toc,positions):
+            fdload_view[position:position+entry.num_bytes]=entry.file.get_disk_data()
+
+    return FDLoadData(data=fdload_data,toc=toc)
+
+@traced
+def save_fdload_data(fdload,options):
+    fdload_data=fdload.data
+    toc=fdload.toc
 
     # # assert len(toc)==len(file_contents)
     # # for i in range(len(toc)): assert toc[i].num_bytes==len(file_contents[i])
@@ -329,7 +1372,16 @@ def build_fdload_data_cmd(files,options):
         'num_files':len(toc),
         'files':[],
     }
+    all_chunks=[]
     for index,entry in enumerate(toc):
+        chunks=get_toc_entry_chunks(entry)
+        all_chunks.append(chunks)
+
+        decompression_cycles=None
+        chunk_cycles=[chunk['decompression_cycles'] for chunk in chunks]
+        if entry.file.compressed and None not in chunk_cycles:
+            decompression_cycles=sum(chunk_cycles)
+
         toc_json['files'].append({
             'ident':entry.file.ident,
             'path':entry.file.path,
@@ -337,12 +1389,20 @@ def build_fdload_data_cmd(files,options):
             'index':index,
             'ltrack':entry.ltrack,
             'sector':entry.sector,
+            'offset':entry.offset,
             'num_bytes':entry.num_bytes,
+            'decompression_cycles':decompression_cycles,
+            'chunks':chunks,
         })
         
     with open_output_file('toc.json','wt') as f:
         json.dump(toc_json,f,indent=4*' ')
 
+    report=get_build_report(fdload,toc_json,options)
+    with open_output_file('report.json','wt') as f:
+        json.dump(report,f,indent=4*' ')
+    if options.report: print_build_report(report,options)
+
     toc_binary=bytearray()
     toc_binary.append(len(toc))
     for entry in toc:
@@ -354,13 +1414,211 @@ def build_fdload_data_cmd(files,options):
         flags_and_sector|=entry.sector
         if entry.file.compressed: flags_and_sector|=0x80
         if entry.file.execute: flags_and_sector|=0x40
+        if entry.file.continues: flags_and_sector|=0x20
         toc_binary.append(flags_and_sector)
 
-        toc_binary.append(-entry.num_bytes&0xff)
-        toc_binary.append(-entry.num_bytes>>8&0xff)
+        # fdload reads from the start of the start sector.
+        num_bytes=entry.offset+entry.num_bytes
+        assert num_bytes<65536 or entry.offset==0
+        toc_binary.append(-num_bytes&0xff)
+        toc_binary.append(-num_bytes>>8&0xff)
+
+        # (fdload_toc_offsets=true.)
+        if options.pack: toc_binary.append(entry.offset)
+        else: assert entry.offset==0
+
+    # Disks of a spanned list all have TOCs the same size, so each
+    # loader1 can be made from disk 0's. fdload ignores entries past
+    # num_files.
+    if options.g_span_num_toc_entries is not None:
+        assert len(toc)<=options.g_span_num_toc_entries
+        toc_entry_size=5 if options.pack else 4
+        toc_binary+=bytes((options.g_span_num_toc_entries-len(toc))*
+                          toc_entry_size)
 
     with open_output_file('toc.dat','wb') as f: f.write(toc_binary)
 
+    with open_output_file('toc_chunks.dat','wb') as f:
+        f.write(get_toc_chunks_binary(all_chunks))
+
+# Where the capacity and build time went, per file. Load times are
+# from the timing model, loading the files in load order (and
+# decompressing them after each track, as fdload does). padding is
+# the unused space between the end of the file and the start of the
+# next one on disk.
+def get_build_report(fdload,toc_json,options):
+    results,sim=fdload_timing.simulate_toc(toc_json,
+                                           get_load_order([entry.file for entry in fdload.toc],
+                                                          options),
+                                           decompress='sequential')
+    load_time_by_index={}
+    for result in results:
+        load_time_by_index.setdefault(result.index,
+                                      result.end_time-result.start_time)
+
+    def get_position(entry):
+        return ((entry.ltrack*16+entry.sector)-32)*256+entry.offset
+
+    next_position_by_index={}
+    next_position=len(fdload.data)
+    for entry in sorted(fdload.toc,key=get_position,reverse=True):
+        next_position_by_index[entry.index]=next_position
+        next_position=get_position(entry)
+
+    store=options.g_file_store
+    files=[]
+    for entry in fdload.toc:
+        file=entry.file
+        raw_size=store.get_size(file.path)
+        compress_time=None
+        if file.compressed: compress_time=file.get_zx02_compress_time()
+        position=get_position(entry)
+        files.append({
+            'index':entry.index,
+            'ident':file.ident,
+            'path':file.path,
+            'compressed':file.compressed,
+            'raw_size':raw_size,
+            'disk_size':entry.num_bytes,
+            'ratio':entry.num_bytes/raw_size,
+            'num_sectors':get_num_sectors(entry.offset+entry.num_bytes),
+            'padding':next_position_by_index[entry.index]-(position+entry.num_bytes),
+            'ltrack':entry.ltrack,
+            'sector':entry.sector,
+            'offset':entry.offset,
+            # None if not compressed, or if the zx02 data came from
+            # the cache.
+            'compress_time':compress_time,
+            'cache_hit':file.compressed and compress_time is None,
+            'load_time':load_time_by_index.get(entry.index),
+        })
+
+    raw_size=sum([file['raw_size'] for file in files])
+    disk_size=sum([file['disk_size'] for file in files])
+    return {
+        'files':files,
+        'total':{
+            'num_files':len(files),
+            'raw_size':raw_size,
+            'disk_size':disk_size,
+            'ratio':disk_size/raw_size if raw_size>0 else None,
+            'fdload_data_size':len(fdload.data),
+            'max_fdload_data_size':MAX_FDLOAD_DATA_SIZE,
+            'padding':sum([file['padding'] for file in files]),
+            'compress_time':sum([file['compress_time'] or 0 for file in files]),
+            'num_cache_hits':len([file for file in files if file['cache_hit']]),
+            'load_time':sim.time,
+        },
+    }
+
+def print_build_report(report,options):
+    print('%5s %-20s %7s %7s %6s %7s %7s %9s %9s %9s'%
+          ('Index','Ident','Raw','Disk','Ratio','Sectors','Padding','L/S','Compress','Load (ms)'))
+    for file in report['files']:
+        if file['compress_time'] is not None:
+            compress='%.2f s'%file['compress_time']
+        elif file['cache_hit']: compress='cached'
+        else: compress='-'
+        location='%d/%d'%(file['ltrack'],file['sector'])
+        if file['offset']!=0: location+='+%d'%file['offset']
+        print('%5d %-20s %7d %7d %5.1f%% %7d %7d %9s %9s %9.1f'%
+              (file['index'],
+               file['ident'],
+               file['raw_size'],
+               file['disk_size'],
+               file['ratio']*100,
+               file['num_sectors'],
+               file['padding'],
+               location,
+               compress,
+               (file['load_time'] or 0)*1000))
+
+    total=report['total']
+    print()
+    print('{}: {:,} files: {:,} -> {:,} bytes ({:.1%}); fdload data {:,}/{:,} bytes, {:,} bytes padding; compressing: {:.2f} s, {:,} cache hits; modelled load time {:.2f} s'.format(
+        get_disk_name(options),
+        total['num_files'],
+        total['raw_size'],
+        total['disk_size'],
+        total['ratio'] or 0,
+        total['fdload_data_size'],
+        total['max_fdload_data_size'],
+        total['padding'],
+        total['compress_time'],
+        total['num_cache_hits'],
+        total['load_time']))
+
+# One chunk per track read. src_end is the offset in the file data of
+# the end of the chunk. dest_end is the amount of output that's
+# complete once the chunk has been decompressed - the same as src_end
+# for an uncompressed file.
+#
+# With a packed layout, the first read also reads the end of whatever
+# comes before the file in its start sector, so the first chunk's
+# size excludes that.
+def get_toc_entry_chunks(entry):
+    reads=fdload_timing.get_track_reads(entry.ltrack,
+                                        entry.sector,
+                                        entry.offset+entry.num_bytes)
+    chunk_sizes=[read.num_bytes for read in reads]
+    chunk_sizes[0]-=entry.offset
+
+    zx02_chunks=None
+    if entry.file.compressed:
+        zx02_chunks=entry.file.get_zx02_chunk_info(chunk_sizes)
+
+    chunks=[]
+    src_end=0
+    for i,read in enumerate(reads):
+        src_end+=chunk_sizes[i]
+        chunk={
+            'ltrack':read.ltrack,
+            'sector':read.sector,
+            'num_bytes':chunk_sizes[i],
+            'src_end':src_end,
+            'dest_end':src_end,
+            'decompression_cycles':None,
+        }
+        if zx02_chunks is not None:
+            assert zx02_chunks[i].src_end==src_end
+            chunk['dest_end']=zx02_chunks[i].dest_end
+            chunk['decompression_cycles']=zx02_chunks[i].cycles
+        elif entry.file.compressed:
+            chunk['dest_end']=None
+        chunks.append(chunk)
+    return chunks
+
+# Extended TOC, giving the per-track chunk boundaries for each file,
+# so that a loader can decompress one track while reading the next.
+#
+# +0 - number of files
+# +1 - 2 bytes per file: offset of file's chunk list
+#
+# Each chunk list is 1 byte number of chunks, then for each chunk: 2
+# bytes src_end, then 2 bytes dest_end. All values are little-endian,
+# and 65536 is stored as 0. dest_end is 0 if unknown.
+def get_toc_chunks_binary(all_chunks):
+    assert len(all_chunks)<256
+    header=bytearray([len(all_chunks)])
+    records=bytearray()
+    for chunks in all_chunks:
+        offset=1+2*len(all_chunks)+len(records)
+        if offset>=65536: fatal('extended TOC too large: %d bytes'%offset)
+        header+=struct.pack('<H',offset)
+
+        assert len(chunks)<256
+        records.append(len(chunks))
+        for chunk in chunks:
+            dest_end=chunk['dest_end']
+            if dest_end is None: dest_end=0
+            records+=struct.pack('<HH',chunk['src_end']&0xffff,dest_end&0xffff)
+    return header+records
+
+def build_fdload_data_cmd(files,options):
+    update_files(files)
+    if options.warm_zx02_cache: warm_zx02_cache(files,options)
+    save_fdload_data(make_fdload_data(files,options),options)
+
     # if options.output_beeblink_path is not None:
     #     makedirs(options.output_beeblink_path)
     #     for i in range(len(file_contents)):
@@ -377,7 +1635,125 @@ def build_fdload_data_cmd(files,options):
 ##########################################################################
 ##########################################################################
     
-def build_disk_contents_cmd(files,options):
+##########################################################################
+##########################################################################
+
+# ADFS L disk image. The disk has a fixed layout: old map free space
+# map in sectors 0 and 1, root directory in sectors 2-6, and then
+# !BOOT, filling the rest of the disk.
+#
+# https://mdfs.net/Docs/Comp/Disk/Format/ADFS
+
+ADFS_L_NUM_SECTORS=2*80*16
+ADFS_METADATA_NUM_SECTORS=7
+ADFS_ROOT_DIR_SECTOR=2
+ADFS_DIR_SIZE=5*256
+
+# Size of !BOOT: the whole disk, minus the ADFS metadata at the start
+# of track 0 side 0.
+DISK_CONTENTS_SIZE=(ADFS_L_NUM_SECTORS-ADFS_METADATA_NUM_SECTORS)*256
+
+def get_adfs_map_checksum(sector):
+    assert len(sector)==256
+    total=255
+    carry=0
+    for i in range(254,-1,-1):
+        total+=sector[i]+carry
+        carry=total>>8
+        total&=0xff
+    return total
+
+def get_adfs_dir_checkbyte(dir_data,num_entries):
+    assert len(dir_data)==ADFS_DIR_SIZE
+    acc=0
+    def add(value):
+        nonlocal acc
+        acc=(acc>>13|acc<<19)&0xffffffff
+        acc^=value
+
+    # the used part of the entries: whole words, then any remaining
+    # bytes...
+    end=5+num_entries*26
+    for i in range(0,end&~3,4): add(struct.unpack_from('<I',dir_data,i)[0])
+    for i in range(end&~3,end): add(dir_data[i])
+
+    # ...then the end of the tail, excluding the check byte's word.
+    for i in range(ADFS_DIR_SIZE-40,ADFS_DIR_SIZE-4,4):
+        add(struct.unpack_from('<I',dir_data,i)[0])
+
+    return (acc^acc>>8^acc>>16^acc>>24)&0xff
+
+def put_adfs_name(data,offset,name,max_len):
+    assert len(name)<=max_len
+    encoded=name.encode('ascii')
+    data[offset:offset+len(encoded)]=encoded
+    if len(encoded)<max_len: data[offset+len(encoded)]=13
+
+def put_adfs_3_bytes(data,offset,value):
+    data[offset:offset+3]=struct.pack('<I',value)[:3]
+
+# Fill in the ADFS metadata for a disk with nothing on it but !BOOT.
+def make_adfs_metadata(image,title,opt4):
+    assert len(image)==ADFS_L_NUM_SECTORS*256
+    if len(title)>19: fatal('disk title too long (max 19 chars): %s'%title)
+
+    # Free space map. The disk is full, so the free space list is
+    # empty.
+    map0=bytearray(256)
+    put_adfs_3_bytes(map0,0xfc,ADFS_L_NUM_SECTORS)
+    map1=bytearray(256)
+    # The disc ID is used to spot disk changes, so make it depend on
+    # the contents.
+    with memoryview(image) as image_view:
+        disc_id=hashlib.sha256(image_view[ADFS_METADATA_NUM_SECTORS*256:]).digest()
+    map1[0xfb]=disc_id[0]
+    map1[0xfc]=disc_id[1]
+    map1[0xfd]=opt4
+    map1[0xfe]=0                # free space list length*3
+    map0[0xff]=get_adfs_map_checksum(map0)
+    map1[0xff]=get_adfs_map_checksum(map1)
+
+    # Root directory, with the one entry.
+    root=bytearray(ADFS_DIR_SIZE)
+    root[0]=0                   # master sequence number
+    root[1:5]=b'Hugo'
+
+    entry=5
+    put_adfs_name(root,entry+0,'!BOOT',10)
+    root[entry+0]|=0x80         # R
+    root[entry+1]|=0x80         # W
+    struct.pack_into('<III',root,entry+10,
+                     0xffffffff,0xffffffff,DISK_CONTENTS_SIZE)
+    put_adfs_3_bytes(root,entry+22,ADFS_METADATA_NUM_SECTORS)
+    root[entry+25]=0            # sequence number
+    # root[entry+26]=0 - no more entries
+
+    tail=ADFS_DIR_SIZE-53
+    root[tail+0]=0
+    put_adfs_name(root,tail+1,'$',10)
+    put_adfs_3_bytes(root,tail+11,ADFS_ROOT_DIR_SECTOR)
+    put_adfs_name(root,tail+14,title,19)
+    root[tail+47]=0             # master sequence number
+    root[tail+48:tail+52]=b'Hugo'
+    root[tail+52]=get_adfs_dir_checkbyte(root,1)
+
+    image[0:256]=map0
+    image[256:512]=map1
+    image[ADFS_ROOT_DIR_SECTOR*256:ADFS_ROOT_DIR_SECTOR*256+ADFS_DIR_SIZE]=root
+
+##########################################################################
+##########################################################################
+
+# Offset of a track's data in !BOOT, which is in ADFS sector order:
+# all of side 0, then all of side 1.
+def get_disk_contents_offset(side,track):
+    offset=(side*80+track)*4096-7*256
+    if side==0 and track==0: offset=0
+    assert offset>=0 and offset<DISK_CONTENTS_SIZE
+    return offset
+
+@traced
+def make_disk_image(fdload_data,options):
     exec_data=get_exec_part(options)
 
     # Provided the *EXEC part is smaller than this, it will fit into
@@ -389,53 +1765,96 @@ def build_disk_contents_cmd(files,options):
     exec_data_size=9*256
     check_budget(exec_data,exec_data_size,'loader8 (*EXEC form)')
 
-    # Load fdload data.
-    fdload_data=load_file(get_fdload_data_path(options))
     check_budget(fdload_data,MAX_FDLOAD_DATA_SIZE,'fdload data')
     
     # Load loader1.
     loader1_size=4096
     loader1=load_prg(options.loader1_path)
+    if options.g_span_disk_index is not None and options.g_span_disk_index>0:
+        patch_span_loader1_toc(loader1.data,options)
     check_budget(loader1.data,loader1_size,'loader1 data')
 
     print('{}: loader0={:,}/{:,} ({:,}); loader1={:,}/{:,} ({:,}); fdload={:,}/{:,} ({:,})'.format(
-        os.path.splitext(os.path.basename(options.g_list_py_path))[0],
+        get_disk_name(options),
         len(exec_data),exec_data_size,exec_data_size-len(exec_data),
         len(loader1.data),loader1_size,loader1_size-len(loader1.data),
         len(fdload_data),MAX_FDLOAD_DATA_SIZE,MAX_FDLOAD_DATA_SIZE-len(fdload_data)))
 
-    # Arrange the data in ADFS sector order.
-    output_data=bytearray()
-    for side in range(2):
-        for track in range(80):
-            if track==0 and side==0:
-                output_data+=exec_data
-                output_data+=bytearray(exec_data_size-len(output_data))
-            elif track==0 and side==1:
-                # this is where loader1 goes.
-                output_data+=loader1.data
-                output_data+=bytearray(loader1_size-len(loader1.data))
-            else:
-                ltrack=(track-1)*2+side
-                assert ltrack>=0 and ltrack<159
-            
-                i=ltrack*4096
-                j=len(output_data)
-                if i>len(fdload_data): output_data+=bytearray(4096)
+    # Arrange the data in ADFS sector order, copying each part
+    # straight to its final position in the disk image. Anything not
+    # written to stays zero.
+    image=bytearray(ADFS_L_NUM_SECTORS*256)
+    with memoryview(image) as output_view,memoryview(fdload_data) as fdload_view:
+        def copy(offset,data):
+            offset+=ADFS_METADATA_NUM_SECTORS*256
+            output_view[offset:offset+len(data)]=data
+
+        for side in range(2):
+            for track in range(80):
+                offset=get_disk_contents_offset(side,track)
+                if track==0 and side==0:
+                    copy(offset,exec_data)
+                elif track==0 and side==1:
+                    # this is where loader1 goes.
+                    copy(offset,loader1.data)
                 else:
-                    part=fdload_data[i:i+4096]
-                    output_data+=part
-                    output_data+=bytearray(4096-len(part))
-
-    expected_output_data_size=(2*80*16-7)*256
-    assert len(output_data)==expected_output_data_size,(expected_output_data_size,len(output_data))
+                    ltrack=(track-1)*2+side
+                    assert ltrack>=0 and ltrack<159
+                    with fdload_view[ltrack*4096:ltrack*4096+4096] as part:
+                        copy(offset,part)
+
+    # !BOOT is *EXEC'd on boot.
+    make_adfs_metadata(image,options.title,3)
+
+    return image
+
+# The loaders command only builds disk 0's loader1. The other disks of
+# a spanned list get a copy with disk 0's TOC swapped for theirs.
+def patch_span_loader1_toc(loader1_data,options):
+    disk0_toc=load_file(os.path.join(options.g_span_disk0_intermediate_folder_path,
+                                     'toc.dat'))
+    toc=load_file(os.path.join(options.g_intermediate_folder_path,'toc.dat'))
+    assert len(toc)==len(disk0_toc)
+
+    offset=loader1_data.find(disk0_toc)
+    if offset<0:
+        fatal('%s: disk 0 TOC not found in loader1: %s'%(get_disk_name(options),
+                                                         options.loader1_path))
+    if loader1_data.find(disk0_toc,offset+1)>=0:
+        fatal('%s: disk 0 TOC found more than once in loader1: %s'%(
+            get_disk_name(options),
+            options.loader1_path))
+
+    loader1_data[offset:offset+len(toc)]=toc
+
+# Save the disk image, and/or !BOOT on its own as a .inf file. The
+# image contains !BOOT, so no separate copy is needed.
+@traced
+def save_disk_image(image,options):
+    if options.output_folder_path is not None:
+        makedirs(options.output_folder_path)
+        with memoryview(image) as image_view:
+            save_file(os.path.join(options.output_folder_path,'!BOOT'),
+                      image_view[ADFS_METADATA_NUM_SECTORS*256:])
+
+        with open(os.path.join(options.output_folder_path,'!BOOT.inf'),
+                  'wt') as f:
+            f.write('$.!BOOT FFFFFFFF FFFFFFFF\n')
+
+    for path in options.output_adl_paths:
+        folder_path=os.path.dirname(path)
+        if folder_path!='': makedirs(folder_path)
+        save_file(path,image)
 
-    makedirs(options.output_folder_path)
-    save_file(os.path.join(options.output_folder_path,'!BOOT'),output_data)
-
-    with open(os.path.join(options.output_folder_path,'!BOOT.inf'),
-              'wt') as f:
-        f.write('$.!BOOT FFFFFFFF FFFFFFFF\n')
+def build_disk_contents_cmd(files,options):
+    with open(get_fdload_data_path(options),'rb') as f:
+        if os.fstat(f.fileno()).st_size==0:
+            # can't mmap an empty file.
+            fdload_data=b''
+        else: fdload_data=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        try: save_disk_image(make_disk_image(fdload_data,options),options)
+        finally:
+            if isinstance(fdload_data,mmap.mmap): fdload_data.close()
     
 ##########################################################################
 ##########################################################################
@@ -443,33 +1862,317 @@ def build_disk_contents_cmd(files,options):
 def prepare_cmd(files,options):
     makedirs(options.g_intermediate_folder_path)
     with open(options.output_asm_path,'wt') as f:
+        write_asm_toc_constants(f,options)
         for file_index,file in enumerate(files):
             f.write('file_%s=%d ; %s\n'%(file.ident,file_index,file.path))
+            write_asm_constants(f,file)
+
+# A packed layout's TOC needs fdload assembled to match.
+def write_asm_toc_constants(f,options):
+    if options.pack: f.write('fdload_toc_offsets=true\n')
+
+def write_asm_constants(f,file):
+    for suffix,value in file.get_asm_constants():
+        f.write('file_%s_%s=%d\n'%(file.ident,suffix,value))
 
 ##########################################################################
 ##########################################################################
 
-def beeblink_cmd(files,options):
-    makedirs(options.output_folder_path)
+# Spanning a files list across multiple disks.
+#
+# The files are bin packed onto as few disks as possible, first fit
+# decreasing by number of sectors. A file's group/dictionary prefix
+# data has to be in memory before the file is decompressed, so files
+# linked by prefixes from within the list are packed as one item and
+# always end up on the same disk. Each disk's files stay in list order.
+# Each disk has its own TOC, and a file's index is its index on its
+# disk.
+#
+# The layout can only be worked out once the disk data sizes are
+# known, i.e., after compression, so a spanned list's constants file
+# is written after --parts-command has run. Parts can't refer to
+# files in a spanned list.
+
+# Returns list of lists of files, one per disk.
+def split_files_across_disks(files,max_num_disks,list_name):
+    # Start with an item per file, and merge the items of files
+    # linked by prefixes. (A dictionary can come after the files
+    # compressed against it.)
+    items=[[file] for file in files]
+    item_index_by_path={os.path.normpath(file.path):index
+                        for index,file in enumerate(files)}
+    for file in files:
+        if file.prefix_path is None: continue
+        item_index=item_index_by_path[os.path.normpath(file.path)]
+        prefix_item_index=item_index_by_path.get(
+            os.path.normpath(file.prefix_path))
+        if prefix_item_index is None or prefix_item_index==item_index:
+            continue
+        for moved_file in items[prefix_item_index]:
+            item_index_by_path[os.path.normpath(moved_file.path)]=item_index
+        items[item_index]+=items[prefix_item_index]
+        items[prefix_item_index]=[]
+    items=[item for item in items if len(item)>0]
+
+    Disk=collections.namedtuple('Disk','files num_sectors')
+    max_num_sectors=MAX_FDLOAD_DATA_SIZE//256
+    def get_item_num_sectors(item):
+        return sum([get_num_sectors(len(file.get_disk_data()))
+                    for file in item])
+
+    disks=[]
+    for item in sorted(items,key=get_item_num_sectors,reverse=True):
+        num_sectors=get_item_num_sectors(item)
+        for disk_index,disk in enumerate(disks):
+            if (disk.num_sectors+num_sectors<=max_num_sectors and
+                len(disk.files)+len(item)<=MAX_NUM_FILES):
+                disks[disk_index]=Disk(files=disk.files+item,
+                                       num_sectors=disk.num_sectors+num_sectors)
+                break
+        else:
+            # if the item doesn't fit on a disk of its own, let
+            # make_fdload_data report the problem.
+            disks.append(Disk(files=item,num_sectors=num_sectors))
+
+    if len(disks)>max_num_disks:
+        fatal('%s: needs %d disks (max %d)'%(list_name,
+                                              len(disks),
+                                              max_num_disks))
+
+    index_by_file={id(file):index for index,file in enumerate(files)}
+    return [sorted(disk.files,key=lambda file:index_by_file[id(file)])
+            for disk in disks]
+
+# Path of output for spanned disk disk_index, derived from disk 0's.
+# Disk images get the index added before the extension; anything else
+# (folders, or BBC-style names such as L.PICS) gets it added on the
+# end.
+def get_span_disk_path(path,disk_index):
+    if disk_index==0: return path
+    root,ext=os.path.splitext(path)
+    if ext.lower()=='.adl': return '%s%d%s'%(root,disk_index,ext)
+    else: return '%s%d'%(path,disk_index)
+
+# Constants file for a spanned list: file_IDENT is the file's index on
+# its disk, and file_IDENT_disk is the disk it's on.
+def save_span_asm(disks_files,path,options):
+    with open(path,'wt') as f:
+        write_asm_toc_constants(f,options)
+        for disk_index,files in enumerate(disks_files):
+            for file_index,file in enumerate(files):
+                f.write('file_%s=%d ; %s\n'%(file.ident,file_index,file.path))
+                f.write('file_%s_disk=%d\n'%(file.ident,disk_index))
+                write_asm_constants(f,file)
+
+##########################################################################
+##########################################################################
+
+def save_beeblink_folder(files,folder_path):
+    makedirs(folder_path)
     for file_index,file in enumerate(files):
-        save_file(os.path.join(options.output_folder_path,'$.%d'%file_index),
+        save_file(os.path.join(folder_path,'$.%d'%file_index),
                   file.get_disk_data())
 
-    save_file(os.path.join(options.output_folder_path,'$.COUNT'),
+    save_file(os.path.join(folder_path,'$.COUNT'),
               struct.pack('<I',len(files)))
 
+def beeblink_cmd(files,options):
+    update_files(files)
+    save_beeblink_folder(files,options.output_folder_path)
+
+##########################################################################
+##########################################################################
+
+# Do everything for every disk in one go, sharing the file store, so
+# each input is read, hashed and (if necessary) compressed once.
+#
+# The 6502 parts need assembling at particular points along the way,
+# which is what the commands are for: --parts-command runs once the
+# asm constants files exist, and --loaders-command runs once the TOCs
+# exist.
+
+def run_build_all_command(command,description):
+    if command is None: return
+    try:
+        with trace_span('%s command'%description,command=command):
+            subprocess.run(command,shell=True,check=True)
+    except subprocess.CalledProcessError as e:
+        fatal('%s command failed: %s'%(description,e))
+
+def build_all_cmd(options):
+    num_lists=len(options.g_list_py_paths)
+
+    def get_per_disk_values(values,what,optional=False):
+        if values is None:
+            if optional: values=num_lists*['']
+            else: values=[]
+        if len(values)!=num_lists:
+            fatal('must supply %s once per --list (got %d, expected %d)'%
+                  (what,len(values),num_lists))
+        return values
+
+    intermediate_folder_paths=get_per_disk_values(
+        options.g_intermediate_folder_paths,'--intermediate-folder')
+    output_asm_paths=get_per_disk_values(options.output_asm_paths,
+                                         '--output-asm')
+    loader1_paths=get_per_disk_values(options.loader1_paths,'--loader1')
+    output_folder_paths=get_per_disk_values(options.output_folder_paths,
+                                            '--output-contents',
+                                            optional=True)
+    output_adl_paths=get_per_disk_values(options.disk_output_adl_paths,
+                                         '--output-adl',
+                                         optional=True)
+    output_adl_copy_paths=get_per_disk_values(
+        options.disk_output_adl_copy_paths,'--output-adl-copy',optional=True)
+    beeblink_paths=get_per_disk_values(options.beeblink_paths,
+                                       '--beeblink',
+                                       optional=True)
+
+    max_num_disks_values=get_per_disk_values(options.max_num_disks_values,
+                                             '--max-disks',
+                                             optional=True)
+
+    FilesList=collections.namedtuple('FilesList','files options max_num_disks')
+    files_lists=[]
+    for list_index in range(num_lists):
+        disk_options=argparse.Namespace(**vars(options))
+        disk_options.g_list_py_path=options.g_list_py_paths[list_index]
+        disk_options.g_intermediate_folder_path=intermediate_folder_paths[list_index]
+        disk_options.output_asm_path=output_asm_paths[list_index]
+        disk_options.loader1_path=loader1_paths[list_index]
+        disk_options.output_folder_path=output_folder_paths[list_index] or None
+        disk_options.output_adl_paths=[path for path in [output_adl_paths[list_index],output_adl_copy_paths[list_index]] if path!='']
+        max_num_disks=1
+        if max_num_disks_values[list_index]!='':
+            value=max_num_disks_values[list_index]
+            if not value.isdigit() or int(value)<1:
+                fatal('invalid --max-disks: %s'%value)
+            max_num_disks=int(value)
+        files_lists.append(FilesList(files=load_files_list(disk_options.g_list_py_path,
+                                                           disk_options),
+                                     options=disk_options,
+                                     max_num_disks=max_num_disks))
+
+    for files_list in files_lists:
+        if files_list.max_num_disks==1:
+            prepare_cmd(files_list.files,files_list.options)
+
+    run_build_all_command(options.parts_command,'parts')
+
+    # Warm the cache for all disks at once, so any compression is
+    # spread over all the cores even when the disks have only a few
+    # files each.
+    all_files=[]
+    for files_list in files_lists: all_files+=files_list.files
+    update_files(all_files)
+    warm_zx02_cache(all_files,options)
+
+    Disk=collections.namedtuple('Disk','files options beeblink_path')
+    disks=[]
+    for files_list,beeblink_path in zip(files_lists,beeblink_paths):
+        if files_list.max_num_disks==1:
+            disks.append(Disk(files=files_list.files,
+                              options=files_list.options,
+                              beeblink_path=beeblink_path))
+            continue
+
+        disks_files=split_files_across_disks(
+            files_list.files,
+            files_list.max_num_disks,
+            get_disk_name(files_list.options))
+        num_toc_entries=max([len(files) for files in disks_files])
+        for span_disk_index,files in enumerate(disks_files):
+            disk_options=argparse.Namespace(**vars(files_list.options))
+            disk_options.g_span_disk_index=span_disk_index
+            disk_options.g_span_num_toc_entries=num_toc_entries
+            disk_options.g_span_disk0_intermediate_folder_path=files_list.options.g_intermediate_folder_path
+            disk_options.g_intermediate_folder_path=get_span_disk_path(
+                disk_options.g_intermediate_folder_path,span_disk_index)
+            if disk_options.output_folder_path is not None:
+                disk_options.output_folder_path=get_span_disk_path(
+                    disk_options.output_folder_path,span_disk_index)
+            disk_options.output_adl_paths=[
+                get_span_disk_path(path,span_disk_index)
+                for path in disk_options.output_adl_paths]
+            if disk_options.load_order is not None:
+                idents=set([file.ident for file in files])
+                disk_options.load_order=[ident
+                                         for ident in disk_options.load_order
+                                         if ident in idents]
+            makedirs(disk_options.g_intermediate_folder_path)
+            disks.append(Disk(files=files,
+                              options=disk_options,
+                              beeblink_path=beeblink_path))
+
+        save_span_asm(disks_files,
+                      files_list.options.output_asm_path,
+                      files_list.options)
+
+    fdloads=[make_fdload_data(disk.files,disk.options) for disk in disks]
+    for disk,fdload in zip(disks,fdloads):
+        save_fdload_data(fdload,disk.options)
+
+    run_build_all_command(options.loaders_command,'loaders')
+
+    images=[]
+    for disk,fdload in zip(disks,fdloads):
+        images.append(make_disk_image(fdload.data,disk.options))
+    for disk,image in zip(disks,images):
+        save_disk_image(image,disk.options)
+
+    for disk in disks:
+        if disk.beeblink_path!='':
+            save_beeblink_folder(disk.files,disk.beeblink_path)
+
 ##########################################################################
 ##########################################################################
 
+@traced
+def load_files_list(list_py_path,options):
+    # https://stackoverflow.com/a/54956419/1618406
+    spec=importlib.util.spec_from_file_location('file_list',list_py_path)
+    file_list_module=importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(file_list_module)
+
+    files=file_list_module.make_files_list()
+    idents_seen=set()
+    prev_path_by_group={}
+    for file in files:
+        if file.ident in idents_seen:
+            fatal('duplicate ident in files list: %s'%file.ident)
+        idents_seen.add(file.ident)
+        file.set_options(options)
+
+        if file.group is not None:
+            if file.group in prev_path_by_group:
+                file.set_prev_group_file_path(prev_path_by_group[file.group])
+            prev_path_by_group[file.group]=file.path
+
+    # Optional: idents of files in the order the program loads them,
+    # for the layout optimiser.
+    if hasattr(file_list_module,'make_load_order'):
+        options.load_order=file_list_module.make_load_order()
+    else: options.load_order=None
+
+    options.g_all_files+=files
+    
+    return files
+
 def main(argv):
     parser=argparse.ArgumentParser()
-    parser.add_argument('-l','--list',metavar='FILE',dest='g_list_py_path',required=True,help='''use Python script %(metavar)s to get files list''')
-    parser.add_argument('--intermediate-folder',metavar='PATH',dest='g_intermediate_folder_path',required=True,help='''put intermediate file(s) somewhere in %(metavar)s''')
+    parser.set_defaults(fun=None,multi_disk=False,loads_lists=True,g_span_disk_index=None,g_span_num_toc_entries=None,pack=False)
+    parser.add_argument('-l','--list',metavar='FILE',dest='g_list_py_paths',action='append',required=True,help='''use Python script %(metavar)s to get files list. Specify multiple times for build-all''')
+    parser.add_argument('--intermediate-folder',metavar='PATH',dest='g_intermediate_folder_paths',action='append',required=True,help='''put intermediate file(s) somewhere in %(metavar)s. Specify once per --list''')
     # I am too lazy to do the environment variable thing here. It
     # doesn't matter as it's easy to deal with from the Makefile.
     parser.add_argument('--zx02',metavar='PATH',dest='g_zx02_path',required=True,help='''treat %(metavar)s as path to zx02 binary''')
     parser.add_argument('--zx02-cache',metavar='PATH',dest='g_zx02_cache_path',required=True,help='''use %(metavar)s as zx02 cache path''')
     parser.add_argument('--zx02-quick',action='store_true',help='''use zx02 quick non-optimal compression''')
+    parser.add_argument('--verify',dest='g_verify',action='store_true',help='''rehash every file, rather than trusting the hash index for files whose size/mtime/inode haven't changed''')
+    parser.add_argument('--zx02-jobs',metavar='N',dest='g_zx02_jobs',type=int,default=None,help='''run at most %(metavar)s zx02 compression jobs at once when warming the cache. Default: number of CPUs''')
+    parser.add_argument('--zx02-cache-max-bytes',metavar='SIZE',dest='g_zx02_cache_max_bytes',type=parse_size,default=None,help='''after building, evict least recently used zx02 cache entries not used by the files list(s) until the cache is at most %(metavar)s bytes. K/M/G suffixes are OK''')
+    parser.add_argument('--zx02-cache-max-age',metavar='DAYS',dest='g_zx02_cache_max_age',type=float,default=None,help='''after building, evict zx02 cache entries not used by the files list(s) that haven't been used for %(metavar)s days''')
+    parser.add_argument('--trace',metavar='FILE',dest='g_trace_path',default=None,help='''write Chrome trace event format JSON timings of the build stages to %(metavar)s''')
 
     subparsers=parser.add_subparsers()
 
@@ -480,42 +2183,107 @@ def main(argv):
 
     prepare_subparser=add_subparser('prepare',prepare_cmd,help='''find and compress files and generate a constants file with file indexes''')
     prepare_subparser.add_argument('--output-asm',metavar='FILE',dest='output_asm_path',help='''write output to %(metavar)s rather than stdout''')
+    prepare_subparser.add_argument('--pack',action='store_true',help='''set fdload_toc_offsets=true in the constants file, for a build-fdload-data --pack build''')
 
-    warm_zx02_cache_subparser=add_subparser('warm-zx02-cache',warm_zx02_cache_cmd,help='''warm up zx02 cache as much as possible''')
-    warm_zx02_cache_subparser.add_argument('--make',metavar='PATH',dest='make_path',default='make',help='''use %(metavar)s as path to GNU Make. Default: %(default)s''')
+    add_subparser('warm-zx02-cache',warm_zx02_cache_cmd,help='''warm up zx02 cache as much as possible''')
 
     build_fdload_data_subparser=add_subparser('build-fdload-data',build_fdload_data_cmd,help='''generate fdload-friendly part of big data''')
+    build_fdload_data_subparser.add_argument('--warm-zx02-cache',action='store_true',help='''warm up zx02 cache first, as per warm-zx02-cache''')
+    build_fdload_data_subparser.add_argument('--optimise-layout',action='store_true',help='''lay out files to minimise modelled load time''')
+    build_fdload_data_subparser.add_argument('--pack',action='store_true',help='''pack compressed files into sectors with no padding before them. The TOC entries get an offset byte, so fdload has to be assembled with fdload_toc_offsets=true''')
+    build_fdload_data_subparser.add_argument('--report',action='store_true',help='''print build report table. (report.json is written to the intermediate folder regardless)''')
 
     build_disk_contents_subparser=add_subparser('build-disk-contents',build_disk_contents_cmd,help='''generate disk contents''')
     
     build_disk_contents_subparser.add_argument('--loader0',metavar='FILE',required=True,dest='loader0_path',help='''read loader0 code from %(metavar)s, a C64 .prg''')
     build_disk_contents_subparser.add_argument('--loader1',metavar='FILE',required=True,dest='loader1_path',help='''read loader1 code from %(metavar)s, a C64 .prg''')
     build_disk_contents_subparser.add_argument('--vdu21',action='store_true',help='''add a VDU21 in the *EXECable part''')
-    build_disk_contents_subparser.add_argument('output_folder_path',metavar='FOLDER',help='''write disk contents to %(metavar)s''')
+    build_disk_contents_subparser.add_argument('--output-adl',metavar='FILE',dest='output_adl_paths',action='append',default=[],help='''write ADFS L disk image to %(metavar)s. Can be specified multiple times''')
+    build_disk_contents_subparser.add_argument('--title',metavar='TITLE',default='',help='''set disk image root directory title to %(metavar)s''')
+    build_disk_contents_subparser.add_argument('output_folder_path',metavar='FOLDER',nargs='?',default=None,help='''write disk contents (!BOOT and !BOOT.inf) to %(metavar)s''')
 
     beeblink_subparser=add_subparser('beeblink',beeblink_cmd,help='''generate BeebLink DFS-type drive with contents of disk''')
     beeblink_subparser.add_argument('output_folder_path',metavar='FOLDER',help='''write files to %(metavar)s''')
+
+    gc_zx02_cache_subparser=add_subparser('gc-zx02-cache',gc_zx02_cache_cmd,help='''evict old or excess zx02 cache entries. Entries used by any --list are always kept''')
+    gc_zx02_cache_subparser.set_defaults(multi_disk=True)
+    gc_zx02_cache_subparser.add_argument('--max-bytes',metavar='SIZE',type=parse_size,default=None,help='''evict least recently used entries until the cache is at most %(metavar)s bytes. K/M/G suffixes are OK''')
+    gc_zx02_cache_subparser.add_argument('--max-age',metavar='DAYS',type=float,default=None,help='''evict entries that haven't been used for %(metavar)s days''')
+    gc_zx02_cache_subparser.add_argument('-n','--dry-run',action='store_true',help='''print what would happen, but don't delete anything''')
+
+    upgrade_zx02_cache_subparser=add_subparser('upgrade-zx02-cache',upgrade_zx02_cache_cmd,help='''recompress quick mode zx02 cache entries at full quality, at low priority''')
+    upgrade_zx02_cache_subparser.set_defaults(multi_disk=True,loads_lists=False)
+    upgrade_zx02_cache_subparser.add_argument('--limit',metavar='N',type=int,default=None,help='''upgrade at most %(metavar)s entries, most recently used first''')
+    upgrade_zx02_cache_subparser.add_argument('--include-unknown',action='store_true',help='''also upgrade entries of unknown quality''')
+
+    # Per-disk build-all options are specified once per --list, in
+    # the same order.
+    build_all_subparser=add_subparser('build-all',build_all_cmd,help='''run every stage for every --list, in one process''')
+    build_all_subparser.set_defaults(multi_disk=True)
+    build_all_subparser.add_argument('--output-asm',metavar='FILE',dest='output_asm_paths',action='append',help='''write disk's constants file to %(metavar)s. Specify once per --list''')
+    build_all_subparser.add_argument('--loader0',metavar='FILE',required=True,dest='loader0_path',help='''read loader0 code from %(metavar)s, a C64 .prg''')
+    build_all_subparser.add_argument('--loader1',metavar='FILE',dest='loader1_paths',action='append',help='''read disk's loader1 code from %(metavar)s, a C64 .prg. Specify once per --list''')
+    build_all_subparser.add_argument('--vdu21',action='store_true',help='''add a VDU21 in the *EXECable part''')
+    build_all_subparser.add_argument('--output-contents',metavar='FOLDER',dest='output_folder_paths',action='append',help='''write disk contents (!BOOT and !BOOT.inf) to %(metavar)s (empty string for none). If specified, specify once per --list''')
+    build_all_subparser.add_argument('--output-adl',metavar='FILE',dest='disk_output_adl_paths',action='append',help='''write disk's ADFS L disk image to %(metavar)s (empty string for none). If specified, specify once per --list''')
+    build_all_subparser.add_argument('--output-adl-copy',metavar='FILE',dest='disk_output_adl_copy_paths',action='append',help='''also write disk's ADFS L disk image to %(metavar)s (empty string for none). If specified, specify once per --list''')
+    build_all_subparser.add_argument('--max-disks',metavar='N',dest='max_num_disks_values',action='append',help='''if the files don't fit on one disk, spread them across at most %(metavar)s disks (empty string for 1). Disks after the first get their number appended to their output paths, and a copy of the first disk's loader1 with the TOC replaced. If specified, specify once per --list''')
+    build_all_subparser.add_argument('--optimise-layout',action='store_true',help='''lay out files to minimise modelled load time''')
+    build_all_subparser.add_argument('--pack',action='store_true',help='''pack compressed files into sectors with no padding before them. The TOC entries get an offset byte, so fdload has to be assembled with fdload_toc_offsets=true''')
+    build_all_subparser.add_argument('--report',action='store_true',help='''print build report table. (report.json is written to the intermediate folder regardless)''')
+    build_all_subparser.add_argument('--title',metavar='TITLE',default='',help='''set disk images' root directory title to %(metavar)s''')
+    build_all_subparser.add_argument('--beeblink',metavar='FOLDER',dest='beeblink_paths',action='append',help='''write disk's BeebLink DFS-type drive to %(metavar)s (empty string for none). If specified, specify once per --list''')
+    build_all_subparser.add_argument('--parts-command',metavar='COMMAND',help='''run shell command %(metavar)s once the constants files have been written''')
+    build_all_subparser.add_argument('--loaders-command',metavar='COMMAND',help='''run shell command %(metavar)s once the TOC files have been written, before the disk contents are built''')
     
     options=parser.parse_args(argv)
     if options.fun is None:
         parser.print_help()
         sys.exit(1)
 
-    # https://stackoverflow.com/a/54956419/1618406
-    spec=importlib.util.spec_from_file_location('file_list',
-                                                options.g_list_py_path)
-    file_list_module=importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(file_list_module)
-
-    files=file_list_module.make_files_list()
-    idents_seen=set()
-    for file in files:
-        if file.ident in idents_seen:
-            fatal('duplicate ident in files list: %s'%file.ident)
-        idents_seen.add(file.ident)
-        file.set_options(options)
-
-    options.fun(files,options)
+    global g_trace
+    if options.g_trace_path is not None: g_trace=Trace()
+
+    # Save the trace even if the build fails, as that might be the
+    # interesting part.
+    try: main2(options)
+    finally:
+        if g_trace is not None: g_trace.save(options.g_trace_path)
+
+def main2(options):
+    options.g_zx02_compressor=ZX02Compressor(options.g_zx02_path)
+    options.g_zx02_cache_index=ZX02CacheIndex(options.g_zx02_cache_path)
+    options.g_all_files=[]
+    options.g_file_store=FileStore(
+        HashIndex(os.path.join(options.g_intermediate_folder_paths[0],
+                               'hash_index.json')),
+        verify=options.g_verify)
+
+    if options.multi_disk:
+        with trace_span(options.fun.__name__): options.fun(options)
+    else:
+        if (len(options.g_list_py_paths)!=1 or
+            len(options.g_intermediate_folder_paths)!=1):
+            fatal('must supply exactly one --list and --intermediate-folder')
+        options.g_list_py_path=options.g_list_py_paths[0]
+        options.g_intermediate_folder_path=options.g_intermediate_folder_paths[0]
+
+        files=load_files_list(options.g_list_py_path,options)
+        with trace_span(options.fun.__name__): options.fun(files,options)
+
+    # The live set comes from the loaded files lists, so a command
+    # that doesn't load any can't tell what's still in use.
+    if (options.loads_lists and
+        (options.g_zx02_cache_max_bytes is not None or
+         options.g_zx02_cache_max_age is not None)):
+        gc_zx02_cache(get_zx02_root_hashes(options.g_all_files),
+                      options,
+                      options.g_zx02_cache_max_bytes,
+                      get_max_age_seconds(options.g_zx02_cache_max_age))
+
+    with trace_span('save indexes'):
+        options.g_file_store.hash_index.save()
+        options.g_zx02_cache_index.save()
     
 ##########################################################################
 ##########################################################################
@@ -0,0 +1,494 @@
+#!/usr/bin/python3
+import sys,collections,math,argparse,json,bisect
+
+##########################################################################
+##########################################################################
+
+# Rough timing model of fdload reading the disk, for comparing
+# layouts. It's not cycle accurate, and won't match real timings
+# exactly, but it follows the same sequence of FDC commands as fdload
+# does, so it gets the relative costs of seeks and missed sectors
+# right.
+#
+# fdload reads a file a track at a time: seek (Type I, with verify)
+# to the file's logical track, then read multiple sectors from the
+# start sector to the end of the track or file. Subsequent tracks
+# always start from sector 0.
+#
+# The verify reads the first ID field that comes along after the head
+# has settled, and the read command then has to wait for the start
+# sector's ID field to come round. If the start sector's ID was the
+# one the verify used, that's a whole revolution wasted.
+#
+# Bytes are read by fdload's NMI routine, which takes 63 cycles per
+# byte in the normal case (see NMI timing in the notes). That doesn't
+# slow the read down, but the CPU's not doing anything else meanwhile.
+#
+# All times are in seconds. Disk positions are measured in time from
+# the index pulse, on the assumption that every track is formatted
+# the same way.
+
+##########################################################################
+##########################################################################
+
+# revolution_time - time for one revolution
+#
+# num_sectors - number of sectors per track
+#
+# interleave - sector interleave: physical slot of sector N is
+# N*interleave, mod num_sectors (skipping slots already used)
+#
+# step_time - time per track stepped
+#
+# settle_time - head settling time after a Type I command with verify
+#
+# byte_time - time per byte on disk
+#
+# id_bytes - bytes from start of sector slot to end of ID field
+#
+# data_bytes - bytes from start of sector slot to start of sector data
+#
+# command_time - time spent issuing each FDC command, NMI handler
+# setup, etc.
+#
+# cpu_hz - CPU clock speed
+#
+# nmi_cycles_per_byte - CPU cycles spent in the NMI routine per byte
+# read
+DriveModel=collections.namedtuple('DriveModel','revolution_time num_sectors interleave step_time settle_time byte_time id_bytes data_bytes command_time cpu_hz nmi_cycles_per_byte')
+
+# BBC Master: WD1770, 300 rpm, 16 sectors/track, no interleave, 250
+# Kbit/sec MFM (32 usec/byte). fdload uses the 12 ms step rate. 30 ms
+# settling time when verifying.
+DEFAULT_DRIVE_MODEL=DriveModel(revolution_time=0.2,
+                               num_sectors=16,
+                               interleave=1,
+                               step_time=0.012,
+                               settle_time=0.030,
+                               byte_time=32e-6,
+                               id_bytes=22,
+                               data_bytes=22+22+16,
+                               command_time=0.001,
+                               cpu_hz=2e6,
+                               nmi_cycles_per_byte=63)
+
+# Physical slot of each sector.
+def get_sector_slots(num_sectors,interleave):
+    slots=[]
+    used=set()
+    slot=0
+    for sector in range(num_sectors):
+        while slot in used: slot=(slot+1)%num_sectors
+        slots.append(slot)
+        used.add(slot)
+        slot=(slot+interleave)%num_sectors
+    return slots
+
+##########################################################################
+##########################################################################
+
+# One read command's worth of a file.
+TrackRead=collections.namedtuple('TrackRead','ltrack sector num_sectors num_bytes')
+
+# Split a file into the reads fdload does.
+def get_track_reads(ltrack,sector,num_bytes,num_sectors=16):
+    reads=[]
+    while num_bytes>0:
+        n=min(num_bytes,(num_sectors-sector)*256)
+        reads.append(TrackRead(ltrack=ltrack,
+                               sector=sector,
+                               num_sectors=(n+255)//256,
+                               num_bytes=n))
+        num_bytes-=n
+        ltrack+=1
+        sector=0
+    return reads
+
+##########################################################################
+##########################################################################
+
+class Simulator:
+    def __init__(self,model=DEFAULT_DRIVE_MODEL):
+        self._model=model
+        self._sector_slots=get_sector_slots(model.num_sectors,
+                                            model.interleave)
+        self.time=0.0
+        self.phys_track=0       # where fdload's restore leaves it
+        self.num_seeks=0
+        self.num_steps=0
+        self.num_reads=0
+        self.num_bytes=0
+        self.nmi_time=0.0
+        # (start,end) of each sector's data transfer, if recording.
+        self.transfers=None
+
+    def copy(self):
+        result=Simulator(self._model)
+        result.time=self.time
+        result.phys_track=self.phys_track
+        result.num_seeks=self.num_seeks
+        result.num_steps=self.num_steps
+        result.num_reads=self.num_reads
+        result.num_bytes=self.num_bytes
+        result.nmi_time=self.nmi_time
+        if self.transfers is not None: result.transfers=list(self.transfers)
+        return result
+
+    @property
+    def model(self): return self._model
+
+    @property
+    def slot_time(self):
+        return self._model.revolution_time/self._model.num_sectors
+
+    # Time the next ID field for the given sector (or any sector, if
+    # None) starts, at or after time.
+    def _get_next_id_time(self,time,sector=None):
+        slot=math.ceil(time/self.slot_time-1e-9)
+        if sector is not None:
+            slot+=(self._sector_slots[sector]-slot)%self._model.num_sectors
+        return slot*self.slot_time
+
+    def wait(self,duration):
+        assert duration>=0
+        self.time+=duration
+
+    def seek(self,ltrack):
+        phys_track=ltrack>>1
+        num_steps=abs(phys_track-self.phys_track)
+        time=self.time+self._model.command_time
+        time+=num_steps*self._model.step_time+self._model.settle_time
+        time=self._get_next_id_time(time)
+        time+=self._model.id_bytes*self._model.byte_time
+        self.time=time
+        self.phys_track=phys_track
+        self.num_seeks+=1
+        self.num_steps+=num_steps
+
+    # The read stops once num_bytes have been read - fdload cancels
+    # the command - so the last sector may be partial.
+    def read(self,sector,num_bytes):
+        assert num_bytes>0
+        assert sector*256+num_bytes<=self._model.num_sectors*256
+        model=self._model
+        time=self.time+model.command_time
+        num_bytes_left=num_bytes
+        while num_bytes_left>0:
+            # strictly after: the verify (or the previous sector) has
+            # just used an ID field.
+            time=self._get_next_id_time(time,sector)
+            n=min(num_bytes_left,256)
+            time+=model.data_bytes*model.byte_time
+            if self.transfers is not None:
+                self.transfers.append((time,time+n*model.byte_time))
+            time+=n*model.byte_time
+            num_bytes_left-=n
+            sector+=1
+        self.time=time
+        self.num_reads+=1
+        self.num_bytes+=num_bytes
+        self.nmi_time+=num_bytes*model.nmi_cycles_per_byte/model.cpu_hz
+
+    # get_process_time, if not None, is called with each TrackRead
+    # after it's been done, and returns how long the CPU spends on
+    # that data before the next read can start.
+    def load_file(self,ltrack,sector,num_bytes,get_process_time=None):
+        for read in get_track_reads(ltrack,sector,num_bytes,
+                                    self._model.num_sectors):
+            self.seek(read.ltrack)
+            self.read(read.sector,read.num_bytes)
+            if get_process_time is not None:
+                self.wait(get_process_time(read))
+
+    # Time at which the CPU, starting at time, will have had the given
+    # number of cycles to spare. During data transfers, most of its
+    # time goes on the NMI routine.
+    def get_cpu_finish_time(self,time,cycles):
+        model=self._model
+        nmi_fraction=model.nmi_cycles_per_byte/(model.byte_time*model.cpu_hz)
+        transfer_hz=model.cpu_hz*max(1-nmi_fraction,0)
+        transfers=self.transfers or []
+        i=bisect.bisect_right([end for start,end in transfers],time)
+        while cycles>0 and i<len(transfers):
+            start,end=transfers[i]
+            if time<start:
+                free_cycles=(start-time)*model.cpu_hz
+                if free_cycles>=cycles: return time+cycles/model.cpu_hz
+                cycles-=free_cycles
+                time=start
+            free_cycles=(end-time)*transfer_hz
+            if free_cycles>=cycles: return time+cycles/transfer_hz
+            cycles-=free_cycles
+            time=end
+            i+=1
+        return time+cycles/model.cpu_hz
+
+    # Load a compressed file with decompression overlapped with
+    # reading: double buffered, so track N+1 is read while track N is
+    # decompressed. A track can't be read until the buffer it's going
+    # into has been finished with. chunk_cycles is the decompression
+    # cycles for each track's worth of data.
+    def load_file_overlapped(self,ltrack,sector,num_bytes,chunk_cycles):
+        reads=get_track_reads(ltrack,sector,num_bytes,self._model.num_sectors)
+        assert len(chunk_cycles)==len(reads)
+        if self.transfers is None: self.transfers=[]
+
+        read_ends=[]
+        decompress_ends=[]
+        def decompress(i):
+            start=read_ends[i]
+            if i>0: start=max(start,decompress_ends[i-1])
+            decompress_ends.append(self.get_cpu_finish_time(start,
+                                                            chunk_cycles[i]))
+
+        for i,read in enumerate(reads):
+            if i>=2: self.time=max(self.time,decompress_ends[i-2])
+            self.seek(read.ltrack)
+            self.read(read.sector,read.num_bytes)
+            read_ends.append(self.time)
+            # the previous chunk's decompression may overlap this
+            # read, so its transfers need to be known first.
+            if i>=1: decompress(i-1)
+        decompress(len(reads)-1)
+
+        self.time=max(self.time,decompress_ends[-1])
+
+# Time to load a file on its own, with the head already on the right
+# track: the cost of the file itself, independent of layout.
+# get_chunk_process_time is as per Simulator.load_file.
+def get_standalone_load_time(num_bytes,
+                             get_process_time=None,
+                             model=DEFAULT_DRIVE_MODEL):
+    sim=Simulator(model)
+    sim.phys_track=1
+    sim.load_file(2,0,num_bytes,get_process_time)
+    return sim.time
+
+##########################################################################
+##########################################################################
+
+# A file's position on disk, in fdload terms.
+FilePlacement=collections.namedtuple('FilePlacement','ltrack sector num_bytes')
+
+def get_placement(lsector,num_bytes,num_sectors=16):
+    return FilePlacement(ltrack=lsector//num_sectors,
+                         sector=lsector%num_sectors,
+                         num_bytes=num_bytes)
+
+# Simulate loading files in the given order (a list of indexes into
+# placements, possibly with repeats). Returns the Simulator.
+def simulate_loads(placements,load_order,model=DEFAULT_DRIVE_MODEL):
+    sim=Simulator(model)
+    for index in load_order:
+        placement=placements[index]
+        sim.load_file(placement.ltrack,placement.sector,placement.num_bytes)
+    return sim
+
+##########################################################################
+##########################################################################
+
+# Lay files out one after the other, as per list order.
+def get_sequential_lsectors(sizes,first_lsector):
+    lsectors=[]
+    lsector=first_lsector
+    for size in sizes:
+        lsectors.append(lsector)
+        lsector+=(size+255)//256
+    return lsectors
+
+# Choose a start sector for each file, so that loading them in the
+# given order takes as little modelled time as possible. Files go on
+# disk in the order they're first loaded (so each load continues from
+# where the last one left off), followed by any files that aren't in
+# load_order, then any spare space is used to leave gaps between
+# files so that each one starts at a sector the head will be able to
+# read without waiting for another revolution.
+#
+# sizes - size of each file in bytes
+#
+# load_order - file indexes, in order they're loaded
+#
+# max_num_sectors - size of data area, in sectors
+#
+# Returns list of start lsectors, one per file.
+def optimise_layout(sizes,
+                    load_order,
+                    max_num_sectors,
+                    first_lsector,
+                    model=DEFAULT_DRIVE_MODEL):
+    placement_order=[]
+    seen=set()
+    for index in list(load_order)+list(range(len(sizes))):
+        if index not in seen:
+            placement_order.append(index)
+            seen.add(index)
+
+    num_spare_sectors=max_num_sectors-sum([(size+255)//256 for size in sizes])
+
+    lsectors=len(sizes)*[None]
+    lsector=first_lsector
+    sim=Simulator(model)
+    for index in placement_order:
+        best=None
+        # Greedy: skip however many sectors gets this file loaded
+        # soonest. No point trying more than a track's worth.
+        for num_skip in range(min(model.num_sectors,num_spare_sectors)+1):
+            candidate=sim.copy()
+            candidate.load_file((lsector+num_skip)//model.num_sectors,
+                                (lsector+num_skip)%model.num_sectors,
+                                sizes[index])
+            if best is None or candidate.time<best[1].time-1e-9:
+                best=(num_skip,candidate)
+
+        num_skip,sim=best
+        lsectors[index]=lsector+num_skip
+        lsector+=num_skip+(sizes[index]+255)//256
+        num_spare_sectors-=num_skip
+
+    return lsectors
+
+##########################################################################
+##########################################################################
+
+# Per-file results from simulate_toc.
+FileLoadTime=collections.namedtuple('FileLoadTime','index ident ltrack sector num_bytes start_time end_time num_seeks num_steps nmi_time')
+
+# Decompression modes for simulate_toc:
+#
+# None - just read the files
+#
+# 'sequential' - decompress each track's data once it's read, before
+# reading the next, as fdload does
+#
+# 'overlapped' - decompress each track's data while reading the next
+DECOMPRESS_MODES=[None,'sequential','overlapped']
+
+# Simulate loading files from a toc.json, in the given order (list of
+# file indexes). Returns (list of FileLoadTime, Simulator).
+#
+# Decompression cycles come from each file's chunks list. Files
+# without one (uncompressed files, or old toc.json files) take no time
+# to decompress.
+#
+# A file with a non-zero offset (packed layout) also has to read the
+# part of its start sector before it.
+def simulate_toc(toc_json,load_order,model=DEFAULT_DRIVE_MODEL,decompress=None):
+    assert decompress in DECOMPRESS_MODES
+    sim=Simulator(model)
+    results=[]
+    for index in load_order:
+        file=toc_json['files'][index]
+        chunk_cycles=None
+        if decompress is not None and file.get('chunks') is not None:
+            chunk_cycles=[chunk['decompression_cycles'] for chunk in file['chunks']]
+            if None in chunk_cycles: chunk_cycles=None
+
+        num_bytes=file.get('offset',0)+file['num_bytes']
+
+        before=sim.copy()
+        if chunk_cycles is None:
+            sim.load_file(file['ltrack'],file['sector'],num_bytes)
+        elif decompress=='sequential':
+            chunk_times=[cycles/model.cpu_hz for cycles in chunk_cycles]
+            sim.load_file(file['ltrack'],
+                          file['sector'],
+                          num_bytes,
+                          lambda read:chunk_times.pop(0))
+        else:
+            assert decompress=='overlapped'
+            sim.load_file_overlapped(file['ltrack'],
+                                     file['sector'],
+                                     num_bytes,
+                                     chunk_cycles)
+        results.append(FileLoadTime(index=index,
+                                    ident=file['ident'],
+                                    ltrack=file['ltrack'],
+                                    sector=file['sector'],
+                                    num_bytes=file['num_bytes'],
+                                    start_time=before.time,
+                                    end_time=sim.time,
+                                    num_seeks=sim.num_seeks-before.num_seeks,
+                                    num_steps=sim.num_steps-before.num_steps,
+                                    nmi_time=sim.nmi_time-before.nmi_time))
+    return results,sim
+
+##########################################################################
+##########################################################################
+
+def get_load_order_from_arg(toc_json,arg):
+    index_by_ident={}
+    for file in toc_json['files']: index_by_ident[file['ident']]=file['index']
+
+    load_order=[]
+    for ident in arg.split(','):
+        ident=ident.strip()
+        if ident=='': continue
+        if ident not in index_by_ident:
+            sys.stderr.write('FATAL: unknown ident: %s\n'%ident)
+            sys.exit(1)
+        load_order.append(index_by_ident[ident])
+    return load_order
+
+def main(argv):
+    parser=argparse.ArgumentParser(description='''predict fdload load times for files in a toc.json''')
+    parser.add_argument('--load-order',metavar='IDENTS',default=None,help='''load files in order given by %(metavar)s, a comma-separated list of idents. Default: load each file in index order''')
+    parser.add_argument('--rpm',metavar='N',type=float,default=60/DEFAULT_DRIVE_MODEL.revolution_time,help='''disk rotates at %(metavar)s rpm. Default: %(default)s''')
+    parser.add_argument('--step-time',metavar='MS',type=float,default=DEFAULT_DRIVE_MODEL.step_time*1000,help='''head step time is %(metavar)s ms. Default: %(default)s''')
+    parser.add_argument('--settle-time',metavar='MS',type=float,default=DEFAULT_DRIVE_MODEL.settle_time*1000,help='''head settling time after seek is %(metavar)s ms. Default: %(default)s''')
+    parser.add_argument('--interleave',metavar='N',type=int,default=DEFAULT_DRIVE_MODEL.interleave,help='''sector interleave is %(metavar)s. Default: %(default)s''')
+    parser.add_argument('toc_path',metavar='FILE',help='''read TOC from %(metavar)s, a toc.json generated by boot_builder''')
+    options=parser.parse_args(argv)
+
+    with open(options.toc_path,'rt') as f: toc_json=json.load(f)
+
+    if options.load_order is None:
+        load_order=list(range(len(toc_json['files'])))
+    else: load_order=get_load_order_from_arg(toc_json,options.load_order)
+
+    model=DEFAULT_DRIVE_MODEL._replace(revolution_time=60/options.rpm,
+                                       step_time=options.step_time/1000,
+                                       settle_time=options.settle_time/1000,
+                                       interleave=options.interleave)
+    results,sim=simulate_toc(toc_json,load_order,model)
+    sequential_results,sequential_sim=simulate_toc(toc_json,
+                                                   load_order,
+                                                   model,
+                                                   'sequential')
+    overlapped_results,overlapped_sim=simulate_toc(toc_json,
+                                                   load_order,
+                                                   model,
+                                                   'overlapped')
+
+    # Read = just reading; Decomp = reading and decompressing, as per
+    # fdload; Overlap = reading and decompressing, overlapped.
+    print('%5s %-20s %6s %6s %7s %5s %5s %9s %9s %9s'%
+          ('Index','Ident','LTrack','Sector','Bytes','Seeks','Steps','Read (ms)','Decomp','Overlap'))
+    for result,sequential_result,overlapped_result in zip(results,
+                                                          sequential_results,
+                                                          overlapped_results):
+        print('%5d %-20s %6d %6d %7d %5d %5d %9.1f %9.1f %9.1f'%
+              (result.index,
+               result.ident,
+               result.ltrack,
+               result.sector,
+               result.num_bytes,
+               result.num_seeks,
+               result.num_steps,
+               (result.end_time-result.start_time)*1000,
+               (sequential_result.end_time-sequential_result.start_time)*1000,
+               (overlapped_result.end_time-overlapped_result.start_time)*1000))
+
+    print()
+    print('Total: {:,} bytes in {:.1f} ms ({:,.0f} bytes/sec); {:,} seeks, {:,} steps; {:.1f} ms in NMI routine'.format(
+        sim.num_bytes,
+        sim.time*1000,
+        sim.num_bytes/sim.time if sim.time>0 else 0,
+        sim.num_seeks,
+        sim.num_steps,
+        sim.nmi_time*1000))
+    print('Including decompression: {:.1f} ms; overlapped: {:.1f} ms ({:+.1%})'.format(
+        sequential_sim.time*1000,
+        overlapped_sim.time*1000,
+        overlapped_sim.time/sequential_sim.time-1 if sequential_sim.time>0 else 0))
+
+if __name__=='__main__': main(sys.argv[1:])
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+import sys,collections,argparse
+
+##########################################################################
+##########################################################################
+
+# Delta-encoded frame sequences, for animation data where consecutive
+# frames differ in only a few bytes.
+#
+# All frames are the same size. The data is:
+#
+# +0 - number of frames (1 byte)
+# +1 - frame size (2 bytes)
+# +3 - offset of each frame's delta, for frames 1 onwards (2 bytes
+#      each), relative to the start of the data
+# ...then frame 0, raw
+# ...then the delta for each subsequent frame
+#
+# Each delta is a sequence of runs. A run is 1 byte skip count, 1 byte
+# XOR count, then that many bytes to XOR with the frame buffer: skip
+# over skip count bytes, then XOR the next XOR count bytes. A run of
+# 0,0 ends the delta. (To skip more than 255 bytes, use runs with an
+# XOR count of 0.)
+#
+# XOR means a delta can be applied either way, so the frames can be
+# played backwards too.
+#
+# All values are little-endian.
+
+class FormatError(Exception): pass
+
+MAX_NUM_FRAMES=255
+
+# Bytes that are the same in each frame don't get stored. A gap
+# between changed bytes that's shorter than this isn't worth starting
+# a new run for: a run costs 2 bytes.
+MIN_SKIP=3
+
+##########################################################################
+##########################################################################
+
+# Returns list of (skip,xor_bytes).
+def get_runs(old,new):
+    assert len(old)==len(new)
+    runs=[]
+    pos=0                       # position after previous run
+    i=0
+    while i<len(new):
+        if old[i]==new[i]:
+            i+=1
+            continue
+
+        # find end of run: next MIN_SKIP-byte stretch with no changes.
+        begin=i
+        end=i+1
+        while end<len(new):
+            if old[end]!=new[end]: end+=1
+            elif old[end:end+MIN_SKIP]==new[end:end+MIN_SKIP]: break
+            else: end+=1
+
+        runs.append((begin-pos,bytes(a^b for a,b in zip(old[begin:end],
+                                                        new[begin:end]))))
+        pos=end
+        i=end
+    return runs
+
+def encode_delta(old,new):
+    data=bytearray()
+    for skip,xor_bytes in get_runs(old,new):
+        while skip>255:
+            data+=bytes([255,0])
+            skip-=255
+        while len(xor_bytes)>255:
+            data+=bytes([skip,255])+xor_bytes[:255]
+            skip=0
+            xor_bytes=xor_bytes[255:]
+        data+=bytes([skip,len(xor_bytes)])+xor_bytes
+    data+=bytes([0,0])
+    return data
+
+def encode(frames):
+    if len(frames)==0: raise FormatError('no frames')
+    if len(frames)>MAX_NUM_FRAMES:
+        raise FormatError('too many frames: %d (max %d)'%(len(frames),
+                                                        MAX_NUM_FRAMES))
+    frame_size=len(frames[0])
+    if frame_size==0 or frame_size>65535:
+        raise FormatError('invalid frame size: %d'%frame_size)
+    for frame_index,frame in enumerate(frames):
+        if len(frame)!=frame_size:
+            raise FormatError('frame %d is %d bytes, not %d'%(frame_index,
+                                                             len(frame),
+                                                             frame_size))
+
+    header_size=3+2*(len(frames)-1)
+    body=bytearray(frames[0])
+    offsets=[]
+    for i in range(1,len(frames)):
+        offsets.append(header_size+len(body))
+        body+=encode_delta(frames[i-1],frames[i])
+
+    data=bytearray([len(frames),frame_size&0xff,frame_size>>8])
+    for offset in offsets:
+        if offset>65535: raise FormatError('too much data')
+        data+=bytes([offset&0xff,offset>>8])
+    data+=body
+    return data
+
+##########################################################################
+##########################################################################
+
+# Header info: (num_frames,frame_size,list of delta offsets).
+Header=collections.namedtuple('Header','num_frames frame_size delta_offsets')
+
+def get_header(data):
+    if len(data)<3: raise FormatError('missing header')
+    num_frames=data[0]
+    frame_size=data[1]|data[2]<<8
+    if num_frames==0: raise FormatError('no frames')
+    if len(data)<3+2*(num_frames-1)+frame_size:
+        raise FormatError('truncated data')
+    delta_offsets=[]
+    for i in range(num_frames-1):
+        delta_offsets.append(data[3+i*2]|data[3+i*2+1]<<8)
+    return Header(num_frames=num_frames,
+                  frame_size=frame_size,
+                  delta_offsets=delta_offsets)
+
+# Generates (skip,xor_bytes) for each run in the delta at data[offset:].
+def iter_delta_runs(data,offset):
+    while True:
+        if offset+2>len(data): raise FormatError('truncated delta')
+        skip=data[offset+0]
+        count=data[offset+1]
+        offset+=2
+        if skip==0 and count==0: break
+        if offset+count>len(data): raise FormatError('truncated delta')
+        yield skip,data[offset:offset+count]
+        offset+=count
+
+# Apply delta at data[offset:] to frame (a bytearray), in place.
+def apply_delta(frame,data,offset):
+    pos=0
+    for skip,xor_bytes in iter_delta_runs(data,offset):
+        pos+=skip
+        if pos+len(xor_bytes)>len(frame):
+            raise FormatError('delta runs off end of frame')
+        for i,value in enumerate(xor_bytes): frame[pos+i]^=value
+        pos+=len(xor_bytes)
+
+# Reference decoder. Returns list of frames.
+def decode(data):
+    header=get_header(data)
+    first=3+2*(header.num_frames-1)
+    frame=bytearray(data[first:first+header.frame_size])
+    frames=[bytes(frame)]
+    for offset in header.delta_offsets:
+        apply_delta(frame,data,offset)
+        frames.append(bytes(frame))
+    return frames
+
+##########################################################################
+##########################################################################
+
+# 6502 cycle costs for applying a delta, for a straightforward player:
+# (zp),y pointers to the delta and frame buffer, with the skip added
+# to the frame pointer, and an X-indexed loop doing lda (delta),y/eor
+# (frame),y/sta (frame),y per byte. There's no 6502 player yet, so
+# these are estimates.
+#
+# Bump CYCLES_MODEL_VERSION when changing any of this.
+CYCLES_MODEL_VERSION=1
+
+# per byte XORed: lda/eor/sta/iny/dex/bne
+XOR_CYCLES_PER_BYTE=5+5+6+2+2+3
+# per run: read skip and count, add skip to frame pointer, set up the
+# loop, then afterwards add count to both pointers
+RUN_CYCLES=60
+# per delta: entry and exit, and reading the terminating run
+DELTA_CYCLES=40
+
+def get_delta_cycles(data,offset):
+    cycles=DELTA_CYCLES
+    for skip,xor_bytes in iter_delta_runs(data,offset):
+        cycles+=RUN_CYCLES+XOR_CYCLES_PER_BYTE*len(xor_bytes)
+    return cycles
+
+# Predicted cycles to apply each delta, i.e., to go from frame i to
+# frame i+1.
+def get_frames_cycles(data):
+    return [get_delta_cycles(data,offset)
+            for offset in get_header(data).delta_offsets]
+
+##########################################################################
+##########################################################################
+
+def main(argv):
+    parser=argparse.ArgumentParser(description='''delta-encode frame sequence''')
+    parser.add_argument('-o','--output',metavar='FILE',dest='output_path',help='''write encoded data to %(metavar)s''')
+    parser.add_argument('--fps',metavar='N',type=float,default=50,help='''assume playback at %(metavar)s frames/second for the stats. Default: %(default)s''')
+    parser.add_argument('frame_paths',metavar='FILE',nargs='+',help='''read frame from %(metavar)s''')
+    options=parser.parse_args(argv)
+
+    frames=[]
+    for path in options.frame_paths:
+        with open(path,'rb') as f: frames.append(f.read())
+
+    try:
+        data=encode(frames)
+        assert decode(data)==frames
+        cycles=get_frames_cycles(data)
+    except FormatError as e:
+        sys.stderr.write('FATAL: %s\n'%e)
+        sys.exit(1)
+
+    raw_size=sum([len(frame) for frame in frames])
+    print('{:,} frames: {:,} -> {:,} bytes ({:.1%})'.format(len(frames),
+                                                          raw_size,
+                                                          len(data),
+                                                          len(data)/raw_size))
+    if len(cycles)>0:
+        # data needed per second, not counting frame 0
+        delta_size=len(data)-(3+2*(len(frames)-1)+len(frames[0]))
+        print('At {:g} fps: {:,.0f} bytes/sec of deltas (raw: {:,.0f}); max {:,} cycles/frame ({:.1%} of 2 MHz)'.format(
+            options.fps,
+            delta_size/len(cycles)*options.fps,
+            len(frames[0])*options.fps,
+            max(cycles),
+            max(cycles)*options.fps/2e6))
+
+    if options.output_path is not None:
+        with open(options.output_path,'wb') as f: f.write(data)
+
+if __name__=='__main__': main(sys.argv[1:])
@@ -67,7 +67,7 @@ def get_char_description(c):
 ##########################################################################
 
 #Glyph=collections.namedtuple('Glyph','pos size')
-Font=collections.namedtuple('Font','image glyph_size glyphs_map')
+Font=collections.namedtuple('Font','pixels width glyph_size glyphs_map')
 
 Char=collections.namedtuple('Char','index')
 
@@ -75,7 +75,7 @@ Char=collections.namedtuple('Char','index')
 def load_font(png_path,glyph_size,first_glyph):
     assert glyph_size.x%2==0
 
-    png_result=png.Reader(filename=png_path).read()
+    png_result=png.Reader(filename=png_path).read_array()
     png_size=V2(png_result[0],png_result[1])
     png_data=png_result[2]
     png_info=png_result[3]
@@ -101,10 +101,19 @@ def load_font(png_path,glyph_size,first_glyph):
                 glyphs_map[glyph]=V2(x,y)
                 glyph+=1
                 
-    return Font(image=[row for row in png_data],
+    # pixels is a flat view of the image, so rows can be sliced out
+    # without copying, whether png_data is a NumPy array or not.
+    return Font(pixels=memoryview(png_data).cast('B'),
+                width=png_size.x,
                 glyph_size=glyph_size,
                 glyphs_map=glyphs_map)
 
+# Row y of the font image, from x0 to x1 (exclusive), as a list of
+# palette indexes.
+def get_font_row(font,y,x0,x1):
+    offset=y*font.width
+    return font.pixels[offset+x0:offset+x1].tolist()
+
 ##########################################################################
 ##########################################################################
 
@@ -133,12 +142,11 @@ def main2(options):
                   3:7,
                   4:0}
     png_background=0
-    for y in range(len(font.image)):
-        for x in range(len(font.image[y])):
-            index=font.image[y][x]
-            if index not in bbc_from_png:
-                fatal('%s: unexpected palette index at (%d,%d): %d'%
-                      (png_path,x,y,index))
+    for i,index in enumerate(font.pixels):
+        if index not in bbc_from_png:
+            y,x=divmod(i,font.width)
+            fatal('%s: unexpected palette index at (%d,%d): %d'%
+                  (png_path,x,y,index))
 
     # find all used chars, and check all are available in font.
     # also note all char pairs.
@@ -177,10 +185,11 @@ def main2(options):
 
                     bytes=[]
                     for y in range(font.glyph_size.y):
+                        row=get_font_row(font,pos.y+y,pos.x,pos.x+font.glyph_size.x)
                         def get_bbc(x):
                             if x is None: return 0
                             else:
-                                value=font.image[pos.y+y][pos.x+x]
+                                value=row[x]
                                 value=bbc_from_png[value]
                                 return value
 
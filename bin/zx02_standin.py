@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+import sys,argparse
+import zx02_stream
+
+##########################################################################
+##########################################################################
+
+# Stand-in for the zx02 binary, taking the same arguments as
+# boot_builder supplies, for running boot_builder when
+# submodules/zx02 isn't built (e.g., bin/benchmark_boot_builder.py).
+# Uses zx02_stream's compressor, so the output is valid but larger.
+
+def main(argv):
+    parser=argparse.ArgumentParser(description='''zx02 stand-in''')
+    parser.add_argument('-f',action='store_true',help='''ignored (output is always overwritten)''')
+    parser.add_argument('-q',dest='quick',action='store_true',help='''quick mode''')
+    parser.add_argument('-p',metavar='N',dest='prefix_size',type=int,default=0,help='''treat first %(metavar)s bytes of input as prefix''')
+    parser.add_argument('input_path',metavar='INPUT',help='''read uncompressed data from %(metavar)s''')
+    parser.add_argument('output_path',metavar='OUTPUT',help='''write zx02 data to %(metavar)s''')
+    options=parser.parse_args(argv)
+
+    with open(options.input_path,'rb') as f: data=f.read()
+    if options.prefix_size<0 or options.prefix_size>len(data):
+        sys.stderr.write('FATAL: invalid prefix size: %d\n'%options.prefix_size)
+        sys.exit(1)
+    prefix=data[:options.prefix_size]
+    data=data[options.prefix_size:]
+
+    try: c_data=zx02_stream.compress(data,prefix,options.quick)
+    except zx02_stream.FormatError as e:
+        sys.stderr.write('FATAL: %s: %s\n'%(options.input_path,e))
+        sys.exit(1)
+
+    with open(options.output_path,'wb') as f: f.write(c_data)
+
+    print('File compressed from %d to %d bytes!'%(len(data),len(c_data)))
+
+if __name__=='__main__': main(sys.argv[1:])
@@ -0,0 +1,571 @@
+#!/usr/bin/python3
+import sys,collections,argparse
+
+##########################################################################
+##########################################################################
+
+# Python model of the zx02 stream format, as understood by the
+# decompressor in src/fdload.s65 - which is a butchered version of
+# zx02-small.asm, and this follows that rather than the zx02 source.
+#
+# Bits are read MSB first, from a reservoir byte that's refilled from
+# the stream as required. The 6502 code only checks for an empty
+# reservoir when reading an Elias-gamma control bit; the compressor
+# arranges things so that the other bits never need a refill. The
+# model reads bits the same way as the 6502 code, so it'll get the
+# same results.
+
+##########################################################################
+##########################################################################
+
+class FormatError(Exception): pass
+
+# kind = 'literal', 'repeat' (copy from last offset) or 'match' (copy
+# from new offset)
+#
+# length = number of bytes output
+#
+# offset = distance back from the output position to copy from (1 =
+# previous byte). None for literals
+#
+# src_begin, src_end = range of stream bytes consumed by this op
+# (including any bits read from reservoir bytes fetched)
+#
+# dest_begin = output position the op starts at
+#
+# num_bits = number of stream bits read (type bit, Elias-gamma bits,
+# and for 'match', the bit that's in the offset LSB byte)
+#
+# elias_length_bits = number of data bits in the length's Elias-gamma
+# code
+#
+# elias_offset_bits = number of data bits in the offset MSB's
+# Elias-gamma code (0 if not 'match')
+#
+# num_refills = number of times the bit reservoir was refilled
+Op=collections.namedtuple('Op','kind length offset src_begin src_end dest_begin num_bits elias_length_bits elias_offset_bits num_refills')
+
+##########################################################################
+##########################################################################
+
+class Reader:
+    def __init__(self,data):
+        self._data=data
+        self._src=0
+        self._bitr=0x80
+        self.num_bits=0
+        self.num_refills=0
+
+    @property
+    def src(self): return self._src
+
+    def get_byte(self):
+        if self._src>=len(self._data): raise FormatError('unexpected end of data')
+        value=self._data[self._src]
+        self._src+=1
+        return value
+
+    # asl bitr, no refill check.
+    def get_unchecked_bit(self):
+        self.num_bits+=1
+        bit=self._bitr>>7
+        self._bitr=self._bitr<<1&0xff
+        return bit
+
+    # asl bitr, refilling if empty.
+    def get_checked_bit(self):
+        self.num_bits+=1
+        bit=self._bitr>>7
+        self._bitr=self._bitr<<1&0xff
+        if self._bitr==0:
+            self.num_refills+=1
+            value=self.get_byte()
+            bit=value>>7
+            self._bitr=(value<<1|1)&0xff
+        return bit
+
+    # Interlaced Elias-gamma code. Returns (value,number of data bits).
+    # Values are 8 bits, as per the 6502 code.
+    #
+    # If first_bit is not None, it's used as the first control bit
+    # (elias_skip1 entry point).
+    def get_elias(self,first_bit=None):
+        if first_bit is None: bit=self.get_checked_bit()
+        else: bit=first_bit
+        value=1
+        num_data_bits=0
+        while bit:
+            value=(value<<1|self.get_unchecked_bit())&0xff
+            num_data_bits+=1
+            bit=self.get_checked_bit()
+        return value,num_data_bits
+
+##########################################################################
+##########################################################################
+
+# 0 means 256 - the copy loop is X-indexed.
+def get_count(value): return 256 if value==0 else value
+
+# Generates Op for each operation in the stream. Doesn't need the
+# output data.
+#
+# If end_op is True, the end marker is generated too, as an Op with
+# kind 'end' and length 0.
+#
+# prefix_size is the size of the data the stream was compressed
+# against (zx02 -p), which must be in memory immediately before the
+# output when decompressing. Copies may refer back into it.
+def iter_ops(data,end_op=False,prefix_size=0):
+    reader=Reader(data)
+    dest=0
+    offset=1
+    state='literal'
+    while True:
+        src_begin=reader.src
+        num_bits_begin=reader.num_bits
+        num_refills_begin=reader.num_refills
+        num_offset_bits=0
+        if state=='literal':
+            value,num_data_bits=reader.get_elias()
+            length=get_count(value)
+            for i in range(length): reader.get_byte()
+            kind='literal'
+            op_offset=None
+            next_state='match' if reader.get_unchecked_bit() else 'repeat'
+        elif state=='repeat':
+            value,num_data_bits=reader.get_elias()
+            length=get_count(value)
+            kind='repeat'
+            op_offset=offset
+            next_state='match' if reader.get_unchecked_bit() else 'literal'
+        else:
+            assert state=='match'
+            msb,num_offset_bits=reader.get_elias()
+            if msb==0:
+                # end marker
+                if end_op:
+                    yield Op(kind='end',
+                             length=0,
+                             offset=None,
+                             src_begin=src_begin,
+                             src_end=reader.src,
+                             dest_begin=dest,
+                             num_bits=reader.num_bits-num_bits_begin,
+                             elias_length_bits=0,
+                             elias_offset_bits=num_offset_bits,
+                             num_refills=reader.num_refills-num_refills_begin)
+                break
+            msb-=1
+            lsb=reader.get_byte()
+            offset=((msb<<7)|(lsb>>1))+1
+            value,num_data_bits=reader.get_elias(lsb&1)
+            length=get_count((value+1)&0xff)
+            kind='match'
+            op_offset=offset
+            next_state='match' if reader.get_unchecked_bit() else 'literal'
+
+        if op_offset is not None and op_offset>prefix_size+dest:
+            raise FormatError('offset %d too large at output position %d'%
+                              (op_offset,dest))
+
+        yield Op(kind=kind,
+                 length=length,
+                 offset=op_offset,
+                 src_begin=src_begin,
+                 src_end=reader.src,
+                 dest_begin=dest,
+                 num_bits=reader.num_bits-num_bits_begin,
+                 elias_length_bits=num_data_bits,
+                 elias_offset_bits=num_offset_bits,
+                 num_refills=reader.num_refills-num_refills_begin)
+
+        dest+=length
+        state=next_state
+
+    if reader.src!=len(data):
+        raise FormatError('%d byte(s) of trailing data'%(len(data)-reader.src))
+
+##########################################################################
+##########################################################################
+
+def decompress(data,prefix=b''):
+    result=bytearray(prefix)
+    for op in iter_ops(data,prefix_size=len(prefix)):
+        if op.kind=='literal':
+            # the literal bytes are the last op.length bytes consumed.
+            result+=data[op.src_end-op.length:op.src_end]
+        else:
+            # may overlap.
+            for i in range(op.length): result.append(result[-op.offset])
+    del result[:len(prefix)]
+    return result
+
+##########################################################################
+##########################################################################
+
+# Simple greedy compressor producing streams in the same format, for
+# use when the real zx02 isn't available (see bin/zx02_standin.py).
+# It's nowhere near as good as zx02, and it's slow.
+#
+# Writes bits the same way Reader reads them. Every op is an even
+# number of bits, and the unchecked bits always come at odd positions,
+# so they never need a refill.
+#
+# Counts are 8 bits, as per the 6502 code, so a run of literals has to
+# be broken up by a copy at least every 256 bytes. There might not be
+# anything to copy, in which case it gives up with a FormatError. (The
+# benchmark's synthetic data is generated so this doesn't happen.)
+
+MAX_OFFSET=(254<<7|127)+1
+MAX_LENGTH=256
+
+class Writer:
+    def __init__(self):
+        self.data=bytearray()
+        self._bit_index=None
+        self._bit_mask=0
+
+    def put_byte(self,value): self.data.append(value)
+
+    def put_bit(self,bit,checked=True):
+        if self._bit_mask==0:
+            assert checked,'unchecked bit needs refill'
+            self._bit_index=len(self.data)
+            self.data.append(0)
+            self._bit_mask=0x80
+        if bit: self.data[self._bit_index]|=self._bit_mask
+        self._bit_mask>>=1
+
+    # Interlaced Elias-gamma code, as read by Reader.get_elias. value
+    # is 1-256, 256 being read back as 0.
+    #
+    # If skip1 is True, the first control bit isn't written, and is
+    # returned instead (for the offset LSB byte).
+    def put_elias(self,value,skip1=False):
+        assert value>=1 and value<=256
+        num_data_bits=value.bit_length()-1
+        first_bit=None
+        for i in range(num_data_bits-1,-1,-1):
+            if skip1 and first_bit is None: first_bit=1
+            else: self.put_bit(1)
+            self.put_bit(value>>i&1,checked=False)
+        if skip1 and first_bit is None: first_bit=0
+        else: self.put_bit(0)
+        return first_bit
+
+# Returns number of bytes at buf[a:] that match buf[b:], up to
+# max_length.
+def get_match_length(buf,a,b,max_length):
+    n=0
+    while n<max_length and buf[a+n]==buf[b+n]: n+=1
+    return n
+
+def compress(data,prefix=b'',quick=False):
+    if len(data)==0: raise FormatError('no data')
+
+    buf=bytes(prefix)+bytes(data)
+    max_chain_length=4 if quick else 64
+
+    # positions of each 2-byte sequence, oldest first.
+    positions_by_pair={}
+    num_inserted=0
+
+    # Returns (length,offset) of longest copy at pos with a new offset,
+    # or (0,None).
+    def find_match(pos):
+        nonlocal num_inserted
+        while num_inserted<pos:
+            pair=buf[num_inserted:num_inserted+2]
+            positions_by_pair.setdefault(pair,[]).append(num_inserted)
+            num_inserted+=1
+
+        best_length,best_offset=0,None
+        max_length=min(MAX_LENGTH,len(buf)-pos)
+        if max_length<2: return best_length,best_offset
+        positions=positions_by_pair.get(buf[pos:pos+2],[])
+        num_tried=0
+        for i in range(len(positions)-1,-1,-1):
+            src=positions[i]
+            if src>=pos: continue
+            if pos-src>MAX_OFFSET or num_tried==max_chain_length: break
+            num_tried+=1
+            length=get_match_length(buf,src,pos,max_length)
+            if length>best_length:
+                best_length,best_offset=length,pos-src
+                if length==max_length: break
+        return best_length,best_offset
+
+    def get_repeat_length(pos,offset):
+        if offset>pos: return 0
+        return get_match_length(buf,pos-offset,pos,min(MAX_LENGTH,
+                                                       len(buf)-pos))
+
+    # ops are (kind,length,offset or literal bytes)
+    ops=[]
+    offset=1
+    pos=len(prefix)
+    literal_begin=pos
+
+    def add_copy(kind,length,copy_offset):
+        nonlocal pos,literal_begin,offset
+        if pos>literal_begin:
+            ops.append(('literal',pos-literal_begin,buf[literal_begin:pos]))
+        ops.append((kind,length,copy_offset))
+        offset=copy_offset
+        pos+=length
+        literal_begin=pos
+
+    while pos<len(buf):
+        literal_length=pos-literal_begin
+
+        # the stream has to start with a literal.
+        if len(ops)>0 or literal_length>0:
+            # a repeat can only follow a literal.
+            repeat_length=0
+            if literal_length>0: repeat_length=get_repeat_length(pos,offset)
+            match_length,match_offset=find_match(pos)
+
+            if repeat_length>=2 and repeat_length>=match_length-1:
+                add_copy('repeat',repeat_length,offset)
+                continue
+            elif (match_length>=3 or
+                  (match_length==2 and match_offset<=128)):
+                add_copy('match',match_length,match_offset)
+                continue
+
+        if literal_length==MAX_LENGTH:
+            # Must copy something here, or earlier. Take anything.
+            for end in range(pos,literal_begin,-1):
+                pos=end
+                repeat_length=get_repeat_length(pos,offset)
+                if repeat_length>=1:
+                    add_copy('repeat',repeat_length,offset)
+                    break
+                match_length,match_offset=find_match(pos)
+                if match_length>=2:
+                    add_copy('match',match_length,match_offset)
+                    break
+            else:
+                raise FormatError('nothing to copy in 256 bytes of literals at output position %d'%(literal_begin-len(prefix)))
+            continue
+
+        pos+=1
+
+    if pos>literal_begin:
+        ops.append(('literal',pos-literal_begin,buf[literal_begin:pos]))
+
+    writer=Writer()
+    for i,(kind,length,value) in enumerate(ops):
+        if i>0: writer.put_bit(kind=='match',checked=False)
+        if kind=='literal':
+            writer.put_elias(length)
+            writer.data+=value
+        elif kind=='repeat': writer.put_elias(length)
+        else:
+            assert kind=='match'
+            writer.put_elias(((value-1)>>7)+1)
+            lsb_index=len(writer.data)
+            writer.put_byte(((value-1)&0x7f)<<1)
+            writer.data[lsb_index]|=writer.put_elias(length-1,skip1=True)
+
+    # end marker: a new offset with MSB 0 (256, as it's 8 bits).
+    writer.put_bit(1,checked=False)
+    writer.put_elias(256)
+    return writer.data
+
+##########################################################################
+##########################################################################
+
+# 65C02 cycle costs of fdload's full_decomp, taken from the code, for
+# predicting decompression time. Branches are assumed not to cross
+# pages. The source buffer is page-aligned.
+#
+# Bump CYCLES_MODEL_VERSION when changing any of this, so cached
+# results get recalculated.
+CYCLES_MODEL_VERSION=1
+
+# get_elias: per data bit, with the control bit that precedes it, not
+# counting refills; entry via elias_skip1 skips the first control bit
+# read. Doesn't include the jsr.
+ELIAS_CYCLES_PER_BIT=22
+ELIAS_CYCLES=18
+ELIAS_SKIP1_CYCLES=10
+# extra cycles for a refill, not counting page crossing
+REFILL_CYCLES=29
+# jsr get_src_byte, when not crossing a page
+GET_SRC_BYTE_CYCLES=25
+# extra cycles in get_src_byte when crossing a page
+SRC_PAGE_CYCLES=25
+# copy_bytes, per byte from src/pntr (the last byte is 1 cycle less)
+COPY_SRC_CYCLES_PER_BYTE=43
+COPY_PNTR_CYCLES_PER_BYTE=29
+# extra cycles in copy_bytes when pntr crosses a page
+PNTR_PAGE_CYCLES=4
+# copy_bytes fixed costs: ldy, then the end: not 256 bytes; not 256
+# bytes, and dest crossed a page; 256 bytes
+COPY_START_CYCLES=2
+COPY_END_CYCLES=26
+COPY_END_CARRY_CYCLES=30
+COPY_END_256_CYCLES=23
+# set up pntr (dzx0s_copy), then sec/jsr copy_bytes
+POINTER_CYCLES=18+2+6
+# full_decomp entry (including jsr) and exit
+ENTRY_CYCLES=6+23
+EXIT_CYCLES=3+5+6
+# suspending/resuming at the end of each track's worth of data - a
+# rough guess, as it depends on the stack depth, plus the loop in
+# load_file_contents_routine
+RESUME_CYCLES=300
+
+def get_resume_cycles(num_chunks):
+    # the last byte of each chunk but the last suspends rather than
+    # crossing a page.
+    return max(num_chunks-1,0)*(RESUME_CYCLES-SRC_PAGE_CYCLES)
+
+def get_num_page_crossings(begin,end):
+    # number of addresses in [begin,end) that are $xxff
+    return (end+1)//256-(begin+1)//256
+
+def get_copy_cycles(cycles_per_byte,length,dest_addr):
+    cycles=COPY_START_CYCLES+length*cycles_per_byte-1
+    if length==256: cycles+=COPY_END_256_CYCLES
+    elif (dest_addr&0xff)+length>=256: cycles+=COPY_END_CARRY_CYCLES
+    else: cycles+=COPY_END_CYCLES
+    return cycles
+
+# Predicted cycles for one op. next_kind is the kind of the following
+# op, as it affects the branch at the end.
+def get_op_cycles(op,next_kind,dest_addr=0):
+    cycles=REFILL_CYCLES*op.num_refills
+    cycles+=SRC_PAGE_CYCLES*get_num_page_crossings(op.src_begin,op.src_end)
+    dest=dest_addr+op.dest_begin
+    if op.kind=='literal':
+        # ldx/jsr get_elias/clc/jsr copy_bytes/bcs
+        cycles+=2+6+ELIAS_CYCLES+ELIAS_CYCLES_PER_BIT*op.elias_length_bits
+        cycles+=2+6+get_copy_cycles(COPY_SRC_CYCLES_PER_BYTE,op.length,dest)
+        cycles+=3 if next_kind=='match' else 2
+    elif op.kind=='end':
+        # inx/jsr get_elias/beq
+        cycles+=2+6+ELIAS_CYCLES+ELIAS_CYCLES_PER_BIT*op.elias_offset_bits
+        cycles+=EXIT_CYCLES
+    else:
+        if op.kind=='repeat':
+            # inx/jsr get_elias
+            cycles+=2+6+ELIAS_CYCLES+ELIAS_CYCLES_PER_BIT*op.elias_length_bits
+        else:
+            assert op.kind=='match'
+            # inx/jsr get_elias/beq/dex/txa/lsr/sta
+            cycles+=2+6+ELIAS_CYCLES+ELIAS_CYCLES_PER_BIT*op.elias_offset_bits
+            cycles+=2+2+2+2+3
+            # jsr get_src_byte/ror/sta
+            cycles+=GET_SRC_BYTE_CYCLES+2+3
+            # ldx/jsr elias_skip1/inx/bcc
+            cycles+=2+6+ELIAS_SKIP1_CYCLES+ELIAS_CYCLES_PER_BIT*op.elias_length_bits
+            cycles+=2+3
+        cycles+=POINTER_CYCLES
+        pntr=dest-op.offset
+        cycles+=get_copy_cycles(COPY_PNTR_CYCLES_PER_BYTE,op.length,dest)
+        cycles+=PNTR_PAGE_CYCLES*get_num_page_crossings(pntr,pntr+op.length)
+        cycles+=3 if next_kind=='literal' else 2
+    return cycles
+
+# Predicted 6502 cycles for fdload to decompress data, a zx02 stream.
+# dest_addr is where it's decompressing to - only the LSB matters.
+# num_chunks is the number of separate reads (i.e., tracks) the data
+# is loaded in.
+def get_decompression_cycles(data,dest_addr=0,num_chunks=1,prefix_size=0):
+    cycles=ENTRY_CYCLES
+    for op,op_cycles in iter_op_cycles(data,dest_addr,prefix_size):
+        cycles+=op_cycles
+    cycles+=get_resume_cycles(num_chunks)
+    return cycles
+
+# Generates (Op,cycles) for each op in the stream, including the end
+# marker.
+def iter_op_cycles(data,dest_addr=0,prefix_size=0):
+    ops=list(iter_ops(data,end_op=True,prefix_size=prefix_size))
+    for i,op in enumerate(ops):
+        next_kind=ops[i+1].kind if i+1<len(ops) else None
+        # an end marker after a copy is reached via the 'match'
+        # branch.
+        if next_kind=='end': next_kind='match'
+        yield op,get_op_cycles(op,next_kind,dest_addr)
+
+# Info about each chunk, when the data is read in chunks of the given
+# sizes and decompressed after each read.
+#
+# src_end - offset in the stream of the end of the chunk
+#
+# dest_end - amount of output produced by the ops that are entirely
+# within this chunk and the previous ones
+#
+# cycles - predicted cycles spent decompressing this chunk's data.
+# Each op is counted in the chunk it starts in, so this is only
+# approximate
+ChunkInfo=collections.namedtuple('ChunkInfo','src_end dest_end cycles')
+
+def get_chunk_info(data,chunk_sizes,dest_addr=0,prefix_size=0):
+    chunk_ends=[]
+    end=0
+    for chunk_size in chunk_sizes:
+        end+=chunk_size
+        chunk_ends.append(end)
+    assert end==len(data)
+
+    cycles=len(chunk_sizes)*[0]
+    dest_ends=len(chunk_sizes)*[0]
+    cycles[0]+=ENTRY_CYCLES
+    chunk_index=0
+    for op,op_cycles in iter_op_cycles(data,dest_addr,prefix_size):
+        while op.src_begin>=chunk_ends[chunk_index]: chunk_index+=1
+        cycles[chunk_index]+=op_cycles
+        i=chunk_index
+        while op.src_end>chunk_ends[i]: i+=1
+        dest_ends[i]=max(dest_ends[i],op.dest_begin+op.length)
+    for i in range(len(chunk_sizes)-1):
+        cycles[i]+=get_resume_cycles(2)
+        dest_ends[i+1]=max(dest_ends[i+1],dest_ends[i])
+
+    return [ChunkInfo(src_end=chunk_ends[i],
+                      dest_end=dest_ends[i],
+                      cycles=cycles[i]) for i in range(len(chunk_sizes))]
+
+def get_chunk_decompression_cycles(data,chunk_sizes,dest_addr=0,prefix_size=0):
+    return [chunk.cycles for chunk in get_chunk_info(data,
+                                                     chunk_sizes,
+                                                     dest_addr,
+                                                     prefix_size)]
+
+##########################################################################
+##########################################################################
+
+def main(argv):
+    parser=argparse.ArgumentParser(description='''decompress zx02 file''')
+    parser.add_argument('-o','--output',metavar='FILE',dest='output_path',help='''write uncompressed data to %(metavar)s''')
+    parser.add_argument('--cycles',action='store_true',help='''print predicted fdload decompression time''')
+    parser.add_argument('--prefix',metavar='FILE',dest='prefix_path',help='''data was compressed against contents of %(metavar)s (zx02 -p)''')
+    parser.add_argument('input_path',metavar='FILE',help='''read zx02 data from %(metavar)s''')
+    options=parser.parse_args(argv)
+
+    with open(options.input_path,'rb') as f: data=f.read()
+    prefix=b''
+    if options.prefix_path is not None:
+        with open(options.prefix_path,'rb') as f: prefix=f.read()
+    try:
+        result=decompress(data,prefix)
+        if options.cycles:
+            cycles=get_decompression_cycles(data,prefix_size=len(prefix))
+            print('{}: {:,} -> {:,} bytes: {:,} cycles ({:.1f} cycles/byte; {:.3f} s at 2 MHz)'.format(
+                options.input_path,
+                len(data),
+                len(result),
+                cycles,
+                cycles/len(result) if len(result)>0 else 0,
+                cycles/2e6))
+    except FormatError as e:
+        sys.stderr.write('FATAL: %s: %s\n'%(options.input_path,e))
+        sys.exit(1)
+    if options.output_path is not None:
+        with open(options.output_path,'wb') as f: f.write(result)
+
+if __name__=='__main__': main(sys.argv[1:])
@@ -33,19 +33,24 @@ def main2(options):
 
     square_size=V2(8,16)
 
-    white=(255,255,255,255)
-    black=(0,0,0,255)
+    # BBC colour indexes.
+    white=7
+    black=0
 
     def create_frame_1(frame_index):
-        image=zimg.create_rgba(screen_size)
+        image=zimg.create_indexed(screen_size)
 
         for screen_y in range(screen_size.y):
-            for screen_x in range(screen_size.x):
+            screen_x=0
+            while screen_x<screen_size.x:
                 colour=black
                 fx=((screen_x+frame_index)>>3)
                 fy=(screen_y>>4)
                 if (fx^fy)&1: colour=white
-                image.put_rgba(screen_x,screen_y,colour)
+                # rest of this square's row.
+                n=8-((screen_x+frame_index)&7)
+                image.hline(screen_x,screen_y,n,colour)
+                screen_x+=n
         
         return {None:image}
 
@@ -53,24 +58,25 @@ def main2(options):
     full_progress='*'*50
 
     all_suffixes=set()
-    for frame_index in range(num_frames):
-        if not g_verbose:
-            sys.stdout.write('\rBuild: [%-*.*s]'%(
-                len(full_progress),
-                int(frame_index/(num_frames-1)*len(full_progress)),
-                full_progress))
-            
-        for fun_index,fun in enumerate([create_frame_1]):
-            images=fun(frame_index)
-            for suffix,image in images.items():
-                if suffix is None: suffix='.%d'%fun_index
-                all_suffixes.add(suffix)
-                if options.intermediate_folder is not None:
-                    output_path=os.path.join(options.intermediate_folder,
-                                             '%s%s.%d.png'% (prototype_name,
-                                                             suffix,
-                                                             frame_index))
-                    image.save_png(output_path)
+    with png.ParallelSaver() as saver:
+        for frame_index in range(num_frames):
+            if not g_verbose:
+                sys.stdout.write('\rBuild: [%-*.*s]'%(
+                    len(full_progress),
+                    int(frame_index/(num_frames-1)*len(full_progress)),
+                    full_progress))
+
+            for fun_index,fun in enumerate([create_frame_1]):
+                images=fun(frame_index)
+                for suffix,image in images.items():
+                    if suffix is None: suffix='.%d'%fun_index
+                    all_suffixes.add(suffix)
+                    if options.intermediate_folder is not None:
+                        output_path=os.path.join(options.intermediate_folder,
+                                                 '%s%s.%d.png'% (prototype_name,
+                                                                 suffix,
+                                                                 frame_index))
+                        image.save_png(output_path,saver)
 
     print()
 
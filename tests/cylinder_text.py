@@ -33,8 +33,9 @@ def main2(options):
 
     square_size=V2(8,16)
 
-    white=(255,255,255,255)
-    black=(0,0,0,255)
+    # BBC colour indexes.
+    white=7
+    black=0
 
     # 168/6=28
     pattern=[
@@ -74,14 +75,14 @@ def main2(options):
     #     print('i=%d: theta=%.3f: s=%.3f c=%.3f x=%d'%(i,theta,s,c,x))
     
     def create_frame_1(frame_index):
-        image=zimg.create_rgba(screen_size)
+        image=zimg.create_indexed(screen_size)
 
         theta=(frame_index/num_steps)*2*math.pi
         bar_x=int(screen_size.x//2+math.sin(theta)*screen_size.x//2-0.00001)
 
         for screen_y in range(screen_size.y):
-            bg=(0,0,255,255)
-            fg=(255,255,255,255)
+            bg=4               # blue
+            fg=white
             pattern_row=None
             pattern_index=screen_y//6
             if pattern_index<len(pattern):
@@ -92,9 +93,9 @@ def main2(options):
                 for i in range(5):
                     bar_x=int(screen_size.x//2+math.sin(theta+i*step)*screen_size.x//2-0.00001)
                     
-                    image.put_rgba(bar_x,
-                                   screen_y,
-                                   bg if pattern_row[i]==' ' else fg)
+                    image.put_index(bar_x,
+                                    screen_y,
+                                    bg if pattern_row[i]==' ' else fg)
             
             # bg=(0,0,255,255)
             # colour=bg
@@ -110,25 +111,26 @@ def main2(options):
 
     all_suffixes=set()
     last_progress=None
-    for frame_index in range(num_frames):
-        if not g_verbose:
-            n=num_frames-frame_index
-            sys.stdout.write(str(n))
-            if frame_index%16==15: sys.stdout.write('\n')
-            else: sys.stdout.write(' ')
-            sys.stdout.flush()
-            
-        for fun_index,fun in enumerate([create_frame_1]):
-            images=fun(frame_index)
-            for suffix,image in images.items():
-                if suffix is None: suffix='.%d'%fun_index
-                all_suffixes.add(suffix)
-                if options.intermediate_folder is not None:
-                    output_path=os.path.join(options.intermediate_folder,
-                                             '%s%s.%d.png'% (prototype_name,
-                                                             suffix,
-                                                             frame_index))
-                    image.save_png(output_path)
+    with png.ParallelSaver() as saver:
+        for frame_index in range(num_frames):
+            if not g_verbose:
+                n=num_frames-frame_index
+                sys.stdout.write(str(n))
+                if frame_index%16==15: sys.stdout.write('\n')
+                else: sys.stdout.write(' ')
+                sys.stdout.flush()
+
+            for fun_index,fun in enumerate([create_frame_1]):
+                images=fun(frame_index)
+                for suffix,image in images.items():
+                    if suffix is None: suffix='.%d'%fun_index
+                    all_suffixes.add(suffix)
+                    if options.intermediate_folder is not None:
+                        output_path=os.path.join(options.intermediate_folder,
+                                                 '%s%s.%d.png'% (prototype_name,
+                                                                 suffix,
+                                                                 frame_index))
+                        image.save_png(output_path,saver)
 
     print()
 
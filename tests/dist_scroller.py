@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 import sys,os,argparse,math,subprocess
 import png
+import zimg
 
 ##########################################################################
 ##########################################################################
@@ -128,11 +129,12 @@ def get_bbc_rgba(pixel,mapping=default_mapping):
 def main2(options):
     global g_verbose;g_verbose=options.verbose
     
-    png_result=png.Reader(filename='geebeeyay_8x16.png').asRGBA()
+    png_result=png.Reader(filename='geebeeyay_8x16.png').read_array(rgba=True)
     print('font: %dx%d'%(png_result[0],png_result[1]))
 
-    image=[]
-    for row in png_result[2]: image.append(row)
+    # flat view of the image, 4 bytes per pixel, so rows can be
+    # sliced out without copying, NumPy array or not.
+    pixels=memoryview(png_result[2]).cast('B')
 
     glyphs=[]
     x=0
@@ -142,9 +144,10 @@ def main2(options):
     while x<png_result[0]:
         glyph=create_rgba_image(glyph_width,glyph_height)
         for y in range(png_result[1]):
+            offset=(y*png_result[0]+x)*4
+            row=pixels[offset:offset+glyph_width*4].tolist()
             for dx in range(glyph_width):
-                pixel=get_rgba_pixel(image,x+dx,y)
-                pixel=get_bbc_rgba(pixel,geebeeyay_8x16_mapping)
+                pixel=get_bbc_rgba(tuple(row[dx*4:dx*4+4]),geebeeyay_8x16_mapping)
                 put_rgba_pixel(glyph,dx,y,pixel)
             #glyph.append(image[y][x*4:(x+glyph_width)*4])
         glyphs.append(glyph)
@@ -392,21 +395,27 @@ def main2(options):
 
     names=set()
     full_progress='*'*50
-    for frame_idx in range(num_frames):
-        images=create_frame_image_3(frame_idx)
-
-        if not g_verbose:
-            sys.stdout.write('\r[%-*.*s]'%(len(full_progress),int(frame_idx/(num_frames-1)*len(full_progress)),full_progress))
-
-        if options.intermediate_folder is not None:
-            for name,image in images.items():
-                if image is None: continue
-                names.add(name)
-                if len(name)==0: image=resize_rgba_image(image)
-
-                output_path=os.path.join(options.intermediate_folder,
-                                         'dist_scroller%s.%d.png'%(name,frame_idx))
-                png.from_array(image,'RGBA').save(output_path)
+    with png.ParallelSaver() as saver:
+        for frame_idx in range(num_frames):
+            images=create_frame_image_3(frame_idx)
+
+            if not g_verbose:
+                sys.stdout.write('\r[%-*.*s]'%(len(full_progress),int(frame_idx/(num_frames-1)*len(full_progress)),full_progress))
+
+            if options.intermediate_folder is not None:
+                for name,image in images.items():
+                    if image is None: continue
+                    names.add(name)
+                    if len(name)==0: image=resize_rgba_image(image)
+
+                    output_path=os.path.join(options.intermediate_folder,
+                                             'dist_scroller%s.%d.png'%(name,frame_idx))
+                    w,h=get_rgba_image_size(image)
+                    zimg.save_rgba_png(output_path,
+                                       zimg.V2(w,h),
+                                       b''.join([bytes(row) for row in image]),
+                                       saver,
+                                       indexed=True)
 
     print()
 
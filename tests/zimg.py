@@ -16,43 +16,255 @@ def check_pixel(pixel):
 ##########################################################################
 ##########################################################################
 
-class RGBAImage:
-    def __init__(self,size,data):
+# RGB for each BBC colour index.
+BBC_PALETTE=[(255 if i&1 else 0,255 if i&2 else 0,255 if i&4 else 0)
+             for i in range(8)]
+
+# SHIFT_TABLES[n] shifts each byte left n bits, for bytes.translate.
+SHIFT_TABLES=[bytes([x<<n&0xff for x in range(256)]) for n in range(8)]
+
+# BBC_BIT_TABLES[n] maps 255 to BBC colour index bit n (R=0, G=1,
+# B=2), for bytes.translate.
+BBC_BIT_TABLES=[bytes([1<<n if x==255 else 0 for x in range(256)])
+                for n in range(3)]
+
+# OR together equal-length byte strings, all at once.
+def or_bytes(parts):
+    value=0
+    for part in parts: value|=int.from_bytes(part,'big')
+    return value.to_bytes(len(parts[0]),'big')
+
+# Pack 1 index per byte data, width indexes per row, into bitdepth
+# bits per index, as per PNG.
+def pack_indexes(indexes,width,bitdepth):
+    num_per_byte=8//bitdepth
+    row_padding=-width%num_per_byte
+    if row_padding>0:
+        indexes=b''.join([indexes[i:i+width]+bytes(row_padding)
+                          for i in range(0,len(indexes),width)])
+    return or_bytes([bytes(indexes[i::num_per_byte]).translate(SHIFT_TABLES[8-bitdepth*(i+1)])
+                     for i in range(num_per_byte)])
+
+# Convert RGBA data, 4 bytes per pixel, to BBC colour indexes, 1 byte
+# per pixel. Returns None if there's a pixel that isn't a BBC colour.
+def get_bbc_indexes(rgba):
+    rgba=bytes(rgba)
+    channels=[rgba[i::4] for i in range(4)]
+    if channels[3].translate(None,b'\xff')!=b'': return None
+    for channel in channels[:3]:
+        if channel.translate(None,b'\x00\xff')!=b'': return None
+    return or_bytes([channels[i].translate(BBC_BIT_TABLES[i])
+                     for i in range(3)])
+
+# Save 1 byte per pixel palette indexes as a palettised PNG, with
+# only the colours used, so it's 1, 2 or 4 bits per pixel. If saver
+# is not None, it's a png.ParallelSaver to save with.
+def save_indexed_png(path,size,indexes,saver=None,compression=1,palette=BBC_PALETTE):
+    assert len(indexes)==size.x*size.y
+    used=sorted(set(indexes))
+    assert used[-1]<len(palette)
+    assert len(used)<=16
+    if len(used)<=2: bitdepth=1
+    elif len(used)<=4: bitdepth=2
+    else: bitdepth=4
+
+    table=bytearray(256)
+    for new_index,index in enumerate(used): table[index]=new_index
+    data=pack_indexes(bytes(indexes).translate(table),size.x,bitdepth)
+
+    kwargs={'width':size.x,
+            'height':size.y,
+            'bitdepth':bitdepth,
+            'palette':[palette[index] for index in used],
+            'compression':compression}
+    if saver is None: png.save_buffer(path,data,**kwargs)
+    else: saver.save(path,data,**kwargs)
+
+##########################################################################
+##########################################################################
+
+# Save RGBA data, 4 bytes per pixel, as a PNG. If saver is not None,
+# it's a png.ParallelSaver to save with.
+#
+# If indexed is True, and the data only has BBC colours, it's saved
+# palettised, as per save_indexed_png.
+def save_rgba_png(path,size,data,saver=None,compression=1,indexed=False):
+    assert len(data)==size.x*size.y*4
+    if indexed:
+        indexes=get_bbc_indexes(data)
+        if indexes is not None:
+            save_indexed_png(path,size,indexes,saver,compression)
+            return
+    kwargs={'width':size.x,
+            'height':size.y,
+            'greyscale':False,
+            'alpha':True,
+            'compression':compression}
+    if saver is None: png.save_buffer(path,data,**kwargs)
+    else: saver.save(path,data,**kwargs)
+
+##########################################################################
+##########################################################################
+
+# Image with a fixed number of bytes per pixel, rows stored top to
+# bottom in one bytearray. RGBAImage and IndexedImage say what the
+# bytes mean.
+class PackedImage:
+    __slots__=('_size','_pixel_size','_stride','_data')
+
+    def __init__(self,size,pixel_size,data):
+        assert len(data)==size.x*size.y*pixel_size
         self._size=size
+        self._pixel_size=pixel_size
+        self._stride=size.x*pixel_size
         self._data=data
 
     @property
     def size(self): return self._size
 
-    def get_rgba(self,x,y,default=(0,0,0,255)):
+    # bytes per row.
+    @property
+    def stride(self): return self._stride
+
+    # Returns byte offset of (x,y), or None if it's outside the image.
+    def _get_offset(self,x,y):
         y=int(y)
-        if y<0 or y>=self._size.y: return default
+        if y<0 or y>=self._size.y: return None
         x=int(x)
-        if x<0 or x>=self._size.x: return default
-        x*=4
-        return self._data[y][x:x+4]
+        if x<0 or x>=self._size.x: return None
+        return y*self._stride+x*self._pixel_size
+
+    # Returns (x,y,w,h) of rect clipped to the image, or None if it's
+    # entirely outside.
+    def _clip(self,x,y,w,h):
+        x0=max(int(x),0)
+        y0=max(int(y),0)
+        x1=min(int(x)+w,self._size.x)
+        y1=min(int(y)+h,self._size.y)
+        if x0>=x1 or y0>=y1: return None
+        return x0,y0,x1-x0,y1-y0
+
+    # Fill rect with pixel_bytes, one pixel's worth of bytes.
+    def _fill_rect(self,x,y,w,h,pixel_bytes):
+        rect=self._clip(x,y,w,h)
+        if rect is None: return
+        x,y,w,h=rect
+        n=w*self._pixel_size
+        row=pixel_bytes*w
+        i=y*self._stride+x*self._pixel_size
+        for y in range(h):
+            self._data[i:i+n]=row
+            i+=self._stride
+
+    # Copy w*h pixels from (src_x,src_y) in src, an image of the same
+    # type, to (x,y) in this image. Both rects are clipped. src must
+    # not be this image.
+    def blit(self,x,y,src,src_x=0,src_y=0,w=None,h=None):
+        assert src is not self
+        assert type(src) is type(self)
+        if w is None: w=src.size.x
+        if h is None: h=src.size.y
+        x,y,src_x,src_y=int(x),int(y),int(src_x),int(src_y)
+
+        # clip to src, then to this, adjusting the other rect to
+        # match each time.
+        rect=src._clip(src_x,src_y,w,h)
+        if rect is None: return
+        x+=rect[0]-src_x
+        y+=rect[1]-src_y
+        src_x,src_y,w,h=rect
+        rect=self._clip(x,y,w,h)
+        if rect is None: return
+        src_x+=rect[0]-x
+        src_y+=rect[1]-y
+        x,y,w,h=rect
+
+        n=w*self._pixel_size
+        i=y*self._stride+x*self._pixel_size
+        j=src_y*src._stride+src_x*self._pixel_size
+        for y in range(h):
+            self._data[i:i+n]=src._data[j:j+n]
+            i+=self._stride
+            j+=src._stride
+
+    # memoryview of row y's bytes. Writes go straight to the image.
+    def get_row_view(self,y):
+        assert y>=0 and y<self._size.y
+        return memoryview(self._data)[y*self._stride:(y+1)*self._stride]
+
+##########################################################################
+##########################################################################
+
+# RGBA image, 4 bytes per pixel.
+class RGBAImage(PackedImage):
+    __slots__=()
+
+    def __init__(self,size,data): super().__init__(size,4,data)
+
+    def get_rgba(self,x,y,default=(0,0,0,255)):
+        i=self._get_offset(x,y)
+        if i is None: return default
+        return tuple(self._data[i:i+4])
 
     def put_rgba(self,x,y,pixel):
-        y=int(y)
-        if y<0 or y>=self.size.y: return
-        x=int(x)
-        if x<0 or x>=self._size.x: return default
-        x*=4
+        i=self._get_offset(x,y)
+        if i is None: return
         assert len(pixel)==4
-        self._data[y][x:x+4]=pixel
+        self._data[i:i+4]=bytes(pixel)
+
+    def fill_rect(self,x,y,w,h,pixel):
+        check_pixel(pixel)
+        self._fill_rect(x,y,w,h,bytes(pixel))
 
-    def save_png(self,path):
-        png.from_array(self._data,'RGBA').save(path)
+    def hline(self,x,y,w,pixel): self.fill_rect(x,y,w,1,pixel)
+
+    # As per save_rgba_png.
+    def save_png(self,path,saver=None,compression=1,indexed=False):
+        save_rgba_png(path,self._size,self._data,saver,compression,indexed)
+
+##########################################################################
+##########################################################################
+
+# Image made of BBC colour indexes, 1 byte per pixel, for frames that
+# only use BBC colours. Saves palettised, as per save_indexed_png.
+class IndexedImage(PackedImage):
+    __slots__=()
+
+    def __init__(self,size,data): super().__init__(size,1,data)
+
+    def get_index(self,x,y,default=0):
+        i=self._get_offset(x,y)
+        if i is None: return default
+        return self._data[i]
+
+    def put_index(self,x,y,index):
+        i=self._get_offset(x,y)
+        if i is None: return
+        assert 0<=index<8
+        self._data[i]=index
+
+    def fill_rect(self,x,y,w,h,index):
+        assert 0<=index<8
+        self._fill_rect(x,y,w,h,bytes([index]))
+
+    def hline(self,x,y,w,index): self.fill_rect(x,y,w,1,index)
+
+    # If saver is not None, it's a png.ParallelSaver to save with.
+    def save_png(self,path,saver=None,compression=1):
+        save_indexed_png(path,self._size,self._data,saver,compression)
 
 ##########################################################################
 ##########################################################################
 
 def create_rgba(size,pixel=(255,0,255,255)):
     check_pixel(pixel)
-    data=[]
-    row=size.x*[int(pixel[0]),int(pixel[1]),int(pixel[2]),int(pixel[3])]
-    for y in range(size.y): data.append(row[:])
-    return RGBAImage(size,data)
+    pixel=bytes([int(pixel[0]),int(pixel[1]),int(pixel[2]),int(pixel[3])])
+    return RGBAImage(size,bytearray(pixel*(size.x*size.y)))
+
+# (index 5 is magenta, as per create_rgba's default.)
+def create_indexed(size,index=5):
+    assert 0<=index<8
+    return IndexedImage(size,bytearray([index])*(size.x*size.y))
 
 ##########################################################################
 ##########################################################################